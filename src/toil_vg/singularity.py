@@ -51,7 +51,8 @@ def singularityCall(job,
                workDir=None,
                singularityParameters=None,
                outfile=None,
-               mount_list=None):
+               mount_list=None,
+               environment=None):
     """
     Throws CalledProcessorError if the Singularity invocation returns a non-zero exit code
     This function blocks until the subprocess call to Singularity returns
@@ -69,9 +70,11 @@ def singularityCall(job,
     :param list[str] mount_list: List of directories from which to mount into the
            container via `-B`. Destination convention is /mnt, which almost certainly
            exists in the container.
+    :param dict environment: Environment variables to set for the Singularity
+           invocation, which are passed through into the container.
     """
     return _singularity(job, tool=tool, parameters=parameters, workDir=workDir, singularityParameters=singularityParameters,
-                        outfile=outfile, checkOutput=False, mount_list=mount_list)
+                        outfile=outfile, checkOutput=False, mount_list=mount_list, environment=environment)
 
 
 def singularityCheckOutput(job,
@@ -79,7 +82,8 @@ def singularityCheckOutput(job,
                       parameters=None,
                       workDir=None,
                       singularityParameters=None,
-                      mount_list=None):
+                      mount_list=None,
+                      environment=None):
     """
     Returns the stdout from the Singularity invocation (via subprocess.check_output)
     Throws CalledProcessorError if the Singularity invocation returns a non-zero exit code
@@ -97,11 +101,14 @@ def singularityCheckOutput(job,
     :param list[str] mount_list: List of directories from which to mount into the
            container via `-B`. Destination convention is /mnt, which almost certainly
            exists in the container.
+    :param dict environment: Environment variables to set for the Singularity
+           invocation, which are passed through into the container.
     :returns: Stdout from the singularity call
     :rtype: str
     """
     return _singularity(job, tool=tool, parameters=parameters, workDir=workDir,
-                   singularityParameters=singularityParameters, checkOutput=True, mount_list=mount_list)
+                   singularityParameters=singularityParameters, checkOutput=True, mount_list=mount_list,
+                   environment=environment)
 
 
 def _singularity(job,
@@ -111,7 +118,8 @@ def _singularity(job,
             singularityParameters=None,
             outfile=None,
             checkOutput=False,
-            mount_list=None):
+            mount_list=None,
+            environment=None):
     """
     :param toil.Job.job job: The Job instance for the calling function.
     :param str tool: Name of the Docker image to be used (e.g. quay.io/ucsc_cgl/samtools).
@@ -128,6 +136,8 @@ def _singularity(job,
     :param list[str] mount_list: List of directories from which to mount into the
            container via `-B`. Destination convention is /mnt, which almost certainly
            exists in the container.
+    :param dict environment: Environment variables to set for the Singularity
+           invocation, which are passed through into the container.
     """
     if parameters is None:
         parameters = []
@@ -234,6 +244,9 @@ def _singularity(job,
     download_env = os.environ.copy()
     if not 'rocker/tidyverse' in tool: 
         download_env['TMPDIR'] = '.'
+    if environment:
+        # Singularity passes its environment through to the container
+        download_env.update(environment)
     
     # If parameters is list of lists, treat each list as separate command and chain with pipes
     if len(parameters) > 0 and type(parameters[0]) is list:
@@ -11,6 +11,8 @@ from unittest import TestCase, skip
 from urllib.parse import urlparse
 from uuid import uuid4
 import gzip
+import io
+import json
 import urllib.request
 
 import os, sys
@@ -20,6 +22,10 @@ import pytest
 
 from toil_vg.iostore import IOStore
 from toil_vg.vg_common import test_singularity as check_singularity
+from toil_vg.vg_common import make_url, remove_ext
+from toil_vg.vg_map import mpmap_outputs_gam
+from toil_vg.vg_mapeval import (split_paired_json, compare_position_records, have_sklearn,
+                                position_acc, position_auc, position_max_f1, position_qq)
 
 log = logging.getLogger(__name__)
 
@@ -952,3 +958,112 @@ class VGCGLTest(TestCase):
             shutil.rmtree(self.workdir)
         subprocess.check_call(['toil', 'clean', self.jobStoreLocal])
         
+
+
+class VGUnitTest(TestCase):
+    """
+    Test small pure helpers from toil-vg without running any workflows.
+    """
+
+    def test_mpmap_outputs_gam(self):
+        self.assertTrue(mpmap_outputs_gam(['-F', 'GAM']))
+        self.assertTrue(mpmap_outputs_gam(['--output-fmt', 'GAM']))
+        self.assertTrue(mpmap_outputs_gam(['--output-fmt=GAM']))
+        self.assertTrue(mpmap_outputs_gam(['-F', 'GAMP', '-n', 'DNA', '-F', 'GAM']))
+        self.assertFalse(mpmap_outputs_gam(['-F', 'GAMP']))
+        self.assertFalse(mpmap_outputs_gam(['--output-fmt=GAMP']))
+        # A sample or read group named GAM is not an output format
+        self.assertFalse(mpmap_outputs_gam(['-N', 'GAM', '-F', 'GAMP']))
+        self.assertFalse(mpmap_outputs_gam(['-F']))
+        self.assertFalse(mpmap_outputs_gam([]))
+
+    def test_make_url(self):
+        self.assertEqual(make_url('/data/graph.vg'), 'file:///data/graph.vg')
+        self.assertEqual(make_url('graph.vg'), 'file://' + os.path.abspath('graph.vg'))
+        # A colon alone doesn't make a local path into a URL
+        self.assertEqual(make_url('sample:1.vg'), 'file://' + os.path.abspath('sample:1.vg'))
+        self.assertEqual(make_url('file:///data/graph.vg'), 'file:///data/graph.vg')
+        self.assertEqual(make_url('file:/data/graph.vg'), 'file:/data/graph.vg')
+        self.assertEqual(make_url('s3://bucket/graph.vg'), 's3://bucket/graph.vg')
+        self.assertEqual(make_url('https://host/graph.vg'), 'https://host/graph.vg')
+
+    def test_remove_ext(self):
+        self.assertEqual(remove_ext('reads.gam'), 'reads')
+        self.assertEqual(remove_ext('reads.sorted.gam'), 'reads.sorted')
+        self.assertEqual(remove_ext('reads'), 'reads')
+        self.assertEqual(remove_ext('calls.vcf.gz', '.vcf.gz'), 'calls')
+        self.assertEqual(remove_ext('calls.VCF.GZ', '.vcf.gz'), 'calls')
+        self.assertEqual(remove_ext('calls.vcf', '.gz'), 'calls.vcf')
+        # An empty suffix must not strip the whole string
+        self.assertEqual(remove_ext('calls.vcf', ''), 'calls.vcf')
+
+    def test_split_paired_json(self):
+        workdir = tempfile.mkdtemp()
+        try:
+            json_file = os.path.join(workdir, 'reads.json')
+            end_1_file = os.path.join(workdir, 'reads_1.json')
+            end_2_file = os.path.join(workdir, 'reads_2.json')
+            with open(json_file, 'w') as json_out:
+                for name in ['r1_1', 'r1_2', 'r2_2', 'r2_1', 'unpaired']:
+                    json_out.write(json.dumps({'name': name}) + '\n')
+                json_out.write('\n')
+            
+            split_paired_json(json_file, end_1_file, end_2_file)
+            
+            for end_file, expected in [(end_1_file, ['r1_1', 'r2_1']), (end_2_file, ['r1_2', 'r2_2'])]:
+                with open(end_file) as end_in:
+                    self.assertEqual([json.loads(line)['name'] for line in end_in], expected)
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_compare_position_records(self):
+        truth = io.StringIO(textwrap.dedent("""\
+            a\t.\tchr1\t100\t0\t60
+            b\tt1\tchr1\t200\t0\t60
+            c\t.\tchr2\t300\t0\t60
+            d\t.\tchr1\t400\t0\t60
+            """))
+        # bb and e are not in the truth, d was never aligned, and c has no
+        # aligned positions at all
+        test = io.StringIO(textwrap.dedent("""\
+            a\tx\tchr1\t105\t10\t30
+            b\t.\tchr2\t200\t10\t20
+            bb\t.\tchr1\t1\t0\t0
+            c\t.\t5\t1
+            e\t.\tchr1\t5\t0\t0
+            """))
+        out = io.StringIO()
+        
+        unaligned_count, untrue_count = compare_position_records(truth, test, 100, out)
+        
+        self.assertEqual(unaligned_count, 1)
+        self.assertEqual(untrue_count, 2)
+        self.assertEqual([line.split('\t') for line in out.getvalue().splitlines()],
+                         [['a', '1', '30', 'x'], ['b', '0', '20', 't1'], ['c', '0', '1', '.']])
+
+    def test_position_acc(self):
+        self.assertEqual(position_acc([1, 0, 1, 1]), (4, 0.75))
+        self.assertEqual(position_acc([]), (0, 0))
+
+    @pytest.mark.skipif(not have_sklearn, reason='needs sklearn')
+    def test_position_auc(self):
+        # MAPQ perfectly separates the correct reads from the wrong ones
+        auc, aupr = position_auc([1, 1, 0, 0], [60, 50, 10, 0])
+        self.assertAlmostEqual(auc, 1.0)
+        self.assertAlmostEqual(aupr, 1.0)
+        # All one class has no ROC curve
+        self.assertEqual(position_auc([1, 1], [60, 0]), (0, 0))
+
+    @pytest.mark.skipif(not have_sklearn, reason='needs sklearn')
+    def test_position_max_f1(self):
+        self.assertAlmostEqual(position_max_f1([1, 1, 0, 0], [60, 60, 10, 0]), 2.0 / 3)
+        self.assertAlmostEqual(position_max_f1([1, 1], [60, 0]), 1.0)
+        self.assertEqual(position_max_f1([], []), 0)
+
+    @pytest.mark.skipif(not have_sklearn, reason='needs sklearn')
+    def test_position_qq(self):
+        # MAPQs that match the observed error rates exactly
+        correct = [1] * 9 + [0] + [1] * 99 + [0]
+        mapq = [10] * 10 + [20] * 100
+        self.assertAlmostEqual(position_qq(correct, mapq), 1.0)
+        self.assertEqual(position_qq([], []), 'fail')
@@ -1,4 +1,4 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python3
 """
 vg_augment.py: augment a vg graph to include variation from a GAM alignment
 
@@ -1,52 +1,225 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python3
 """
 Shared stuff between different modules in this package.  Some
 may eventually move to or be replaced by stuff in toil-lib.
 """
 
 import argparse, sys, os, os.path, random, subprocess, shutil, itertools, glob
+import io
 import json, timeit, errno
+import math
+import shlex
 import fcntl
-import select
 import time
 import threading
+import atexit
 from uuid import uuid4
+from urllib.parse import urlparse
 import pkg_resources, tempfile, datetime
 import logging
+import docker
 from distutils.spawn import find_executable
 import collections
-import socket
-import uuid
-import platform
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_EXCEPTION
+from concurrent.futures import wait as wait_futures
+from functools import lru_cache
+from contextlib import contextmanager
 
 from toil.common import Toil
 from toil.job import Job
 from toil.jobStores.fileJobStore import FileJobStore
 from toil.realtimeLogger import RealtimeLogger
-from toil.lib.docker import dockerCall, dockerCheckOutput, apiDockerCall
+from toil.lib.docker import dockerCall, dockerCheckOutput, dockerKill, getContainerName
 from toil_vg.singularity import singularityCall, singularityCheckOutput
 from toil_vg.iostore import IOStore
 
 
 logger = logging.getLogger(__name__)
 
-# We need to fiddle with os.environ and we don't want to step on ourselves
-environment_lock = threading.Lock()
+# Scripts we have already copied out of vg containers, so we only need to
+# start a container to get them once per process. Maps from vg container image
+# to a local copy of its scripts directory.
+vg_script_cache_dirs = {}
+vg_script_cache_lock = threading.Lock()
 
+# Long-lived Docker containers that we exec commands in, instead of paying to
+# create and start a new container for every command. Maps from (image, host
+# working directory) to the running container.
+docker_container_pool = {}
+docker_container_pool_lock = threading.Lock()
+
+# The Docker API client that all our Docker calls share, made on first use, so
+# we don't have to connect and negotiate an API version for every call.
+docker_client = None
+docker_client_lock = threading.Lock()
+
+def get_docker_client():
+    """
+    Get the shared Docker API client.
+    """
+    global docker_client
+    with docker_client_lock:
+        if docker_client is None:
+            docker_client = docker.from_env(version='auto')
+        return docker_client
+
+# Docker images we have already found or pulled in this process, so each
+# image is only looked up (and, if missing, pulled) once per worker.
+docker_images_present = set()
+# Maps from image to the lock that guards looking it up and pulling it, so a
+# big pull of one image doesn't hold up calls that use other images.
+docker_image_locks = collections.defaultdict(threading.Lock)
+docker_image_locks_lock = threading.Lock()
+
+def ensure_docker_image(tool):
+    """
+    Make sure the given Docker image is available locally, pulling it from its
+    registry the first time it is needed if it isn't there yet.
+    
+    containers.create, unlike containers.run, never pulls, so anything that
+    creates containers directly must call this first.
+    """
+    if tool in docker_images_present:
+        return
+    with docker_image_locks_lock:
+        image_lock = docker_image_locks[tool]
+    with image_lock:
+        if tool in docker_images_present:
+            # Someone else pulled it while we waited
+            return
+        client = get_docker_client()
+        try:
+            client.images.get(tool)
+        except docker.errors.ImageNotFound:
+            RealtimeLogger.info("Pulling Docker image {}".format(tool))
+            # Pass the tag separately, since some docker-py versions pull
+            # every tag of a repository when not given one.
+            repository, tag = docker.utils.parse_repository_tag(tool)
+            client.images.pull(repository, tag=tag or 'latest')
+        docker_images_present.add(tool)
+
+def create_docker_container(job, tool, parameters, volumes=None, working_dir=None,
+                            entrypoint=None, environment=None, **kwargs):
+    """
+    Create, but don't start, a Docker container to run the given command, the
+    same way apiDockerCall would run it. Parameters can be a list of strings,
+    or a list of lists of strings to run as a pipeline. Additional keyword
+    arguments are passed along to the Docker API.
+    
+    Returns the docker.models.containers.Container.
+    """
+    if len(parameters) > 0 and isinstance(parameters[0], list):
+        # Chain the commands with pipes in bash
+        entrypoint = ['/bin/bash', '-c']
+        command = ['set -eo pipefail && {}'.format(
+            ' | '.join(' '.join(shlex.quote(a) for a in x) for x in parameters))]
+    else:
+        command = parameters if len(parameters) > 0 else None
+    
+    ensure_docker_image(tool)
+    return get_docker_client().containers.create(tool,
+                                    command=command,
+                                    entrypoint=entrypoint,
+                                    working_dir=working_dir,
+                                    volumes=volumes,
+                                    environment=environment,
+                                    # make certain that files have the correct permissions
+                                    user='{}:{}'.format(os.getuid(), os.getgid()),
+                                    name=getContainerName(job),
+                                    **kwargs)
+
+def get_pooled_container(job, tool, volumes, working_dir, host_work_dir):
+    """
+    Get a running container of the given Docker image, with the given volumes
+    mounted, that we can exec commands in. The container is started on first
+    use, and killed and removed when the job that started it finishes.
+    """
+    key = (tool, host_work_dir)
+    with docker_container_pool_lock:
+        if key in docker_container_pool:
+            # Make sure the container hasn't died (and been auto-removed)
+            # since we last used it. If it has, start a new one.
+            container = docker_container_pool[key]
+            try:
+                container.reload()
+                alive = container.status == 'running'
+            except docker.errors.NotFound:
+                alive = False
+            if not alive:
+                RealtimeLogger.warning("Pooled container {} for {} is gone; replacing it".format(container.id, tool))
+                del docker_container_pool[key]
+        if key not in docker_container_pool:
+            # Start a container that just sits there until it is killed
+            container = create_docker_container(job, tool, ['-f', '/dev/null'],
+                                                volumes=volumes,
+                                                working_dir=working_dir,
+                                                entrypoint='tail',
+                                                auto_remove=True)
+            # Kill it and forget about it at the end of the job
+            job.defer(dockerKill, container.name)
+            job.defer(forget_pooled_container, key)
+            container.start()
+            RealtimeLogger.debug("Started pooled container {} for {}".format(container.id, tool))
+            docker_container_pool[key] = container
+        return docker_container_pool[key]
+
+def exec_in_container(container, command, handle_output, environment=None, workdir=None):
+    """
+    Exec the given command in the given running container, and call
+    handle_output(stdout_data, stderr_data) with each chunk of output as it
+    arrives (either may be None), so the output is never all held in memory.
+    
+    Returns the command's exit code.
+    """
+    api = get_docker_client().api
+    exec_id = api.exec_create(container.id, command, environment=environment, workdir=workdir)['Id']
+    for stdout_data, stderr_data in api.exec_start(exec_id, stream=True, demux=True):
+        handle_output(stdout_data, stderr_data)
+    return api.exec_inspect(exec_id)['ExitCode']
+
+class OutputTail(object):
+    """
+    File-like sink for bytes that keeps only roughly the last max_bytes
+    written, so we can log the end of a command's output if it fails without
+    holding all of it.
+    """
+    def __init__(self, max_bytes=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.chunks = collections.deque()
+        self.size = 0
+        
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        while len(self.chunks) > 1 and self.size - len(self.chunks[0]) >= self.max_bytes:
+            self.size -= len(self.chunks.popleft())
+            
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+def forget_pooled_container(key):
+    """
+    Deferred function to drop a pooled container that is going away from the
+    pool.
+    """
+    with docker_container_pool_lock:
+        docker_container_pool.pop(key, None)
+
+@lru_cache(maxsize=None)
 def test_docker():
     """
     Return true if Docker is available on this machine, and False otherwise.
-    """
     
-    # We don't actually want any Docker output.
-    nowhere = open(os.devnull, 'wb')
+    The answer can't change over the life of the process, so we only probe
+    Docker (which can take a second or more) once.
+    """
     
     try:
-        # Run Docker
+        # Run Docker, without wanting any of its output.
         # TODO: implement around dockerCall somehow?
-        subprocess.check_call(['docker', 'version'], stdout=nowhere, stderr=nowhere)
+        subprocess.check_call(['docker', 'version'], stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
         # And report that it worked
         return True
     except:
@@ -139,6 +312,33 @@ def toil_call(job, context, cmd, work_dir, out_path = None, out_append = False):
     else:
         context.runner.call(job, cmd, work_dir=work_dir)        
     
+def log_output_error(data, chunk_size=1024):
+    """
+    Send the given output bytes from a failed command to the realtime logger
+    as errors, batching lines into messages of about chunk_size characters so
+    we don't make a logging call per line, or a message too big to send.
+    """
+    chunk = []
+    chunk_len = 0
+    for line in data.decode('utf-8', errors='replace').splitlines():
+        chunk.append(line)
+        chunk_len += len(line) + 1
+        if chunk_len >= chunk_size:
+            RealtimeLogger.error(truncate_msg('\n'.join(chunk)))
+            chunk = []
+            chunk_len = 0
+    if chunk:
+        RealtimeLogger.error(truncate_msg('\n'.join(chunk)))
+
+def log_stderr_lines(stderr_file):
+    """
+    Send each line read from the given binary file object to the realtime
+    logger, until EOF. Closes the file when done.
+    """
+    with stderr_file:
+        for line in iter(stderr_file.readline, b''):
+            RealtimeLogger.info('(stderr) {}'.format(line.decode('utf-8', errors='replace').rstrip()))
+    
 class ContainerRunner(object):
     """ Helper class to centralize container calling.  So we can toggle both
 Docker and Singularity on and off in just one place.
@@ -153,20 +353,20 @@ to do: Should go somewhere more central """
         self.docker_tool_map = container_tool_map[0]
         self.container_support = container_tool_map[1]
         self.realtime_stderr = realtime_stderr
+        # Work out how each tool will be run once, up front, since we need to
+        # know for every call.
+        self.container_by_tool = {}
+        if self.container_support in ('Docker', 'Singularity'):
+            for tool_name, image in self.docker_tool_map.items():
+                if image and image.lower() != 'none':
+                    self.container_by_tool[tool_name] = self.container_support
 
     def container_for_tool(self, name):
         """
         Return Docker, Singularity or None, which is how call() would be run
         on the given tool
         """
-        if self.container_support == 'Docker' and name in self.docker_tool_map and\
-           self.docker_tool_map[name] and self.docker_tool_map[name].lower() != 'none':
-            return 'Docker'
-        elif self.container_support == 'Singularity' and name in self.docker_tool_map and\
-           self.docker_tool_map[name] and self.docker_tool_map[name].lower() != 'none':
-            return 'Singularity'
-        else:
-            return 'None'
+        return self.container_by_tool.get(name, 'None')
 
     def call(self, job, args, work_dir = '.' , outfile = None, errfile = None,
              check_output = False, tool_name=None, mount_list=None):
@@ -184,6 +384,10 @@ to do: Should go somewhere more central """
         raise an exception on a nonzero exit status, and return standard
         output's contents.
         
+        Commands always run with LC_ALL=C, however they are run, so sort uses
+        fast byte-wise comparison and produces the same order as comparing the
+        lines as Python strings. Code that merges sorted files relies on this.
+        
         """
         # make python3 errors pop more
         if outfile is not None:
@@ -192,47 +396,51 @@ to do: Should go somewhere more central """
         # from here on, we assume our args is a list of lists
         if len(args) == 0 or len(args) > 0 and type(args[0]) is not list:
             args = [args]
-        # convert everything to string
+        # convert everything to string, and describe the command for logging while we're at it
+        command_parts = []
         for i in range(len(args)):
-            args[i] = [str(x) for x in args[i]]
+            if not all(isinstance(x, str) for x in args[i]):
+                args[i] = [str(x) for x in args[i]]
+            command_parts.append(' '.join(args[i]))
+        command = ' | '.join(command_parts)
         name = tool_name if tool_name is not None else args[0][0]
 
         # optionally log stderr to the realtime logger by making a pipe and
-        # logging the output in a forked process
+        # logging the output in a background thread
         # todo: duplicate errfile to logger rather than ignoring when errfile not None
+        stderr_thread = None
         if self.realtime_stderr and not errfile:
             # Make our pipe
             rfd, wfd = os.pipe()
-            rfile = os.fdopen(rfd, 'rb', 0)
+            rfile = os.fdopen(rfd, 'rb')
             wfile = os.fdopen(wfd, 'wb', 0)
-            # Fork our child process (pid == 0) to catch stderr and log it
-            pid = os.fork()
-            if pid == 0:
-                wfile.close()
-                while 1:
-                    data = rfile.readline()
-                    if not data:
-                        break
-                    RealtimeLogger.info('(stderr) {}'.format(data.strip()))
-                os._exit(0)
-            else:
-                assert pid > 0
-                # main process carries on, but sending stderr to the pipe
-                rfile.close()
-                # note that only call_directly below actually does anything with errfile at the moment
-                errfile = wfile
+            # Start a thread to catch stderr and log it
+            stderr_thread = threading.Thread(target=log_stderr_lines, args=(rfile,))
+            stderr_thread.daemon = True
+            stderr_thread.start()
+            # note that only call_directly below actually does anything with errfile at the moment
+            errfile = wfile
 
         container_type = self.container_for_tool(name)
-                
-        if container_type == 'Docker':
-            # TODO: add mount_list functionality for docker calls
-            return self.call_with_docker(job, args, work_dir, outfile, errfile, check_output, tool_name)
-        elif container_type == 'Singularity':
-            return self.call_with_singularity(job, args, work_dir, outfile, errfile, check_output, tool_name, mount_list)
-        else:
-            return self.call_directly(args, work_dir, outfile, errfile, check_output)
         
-    def call_with_docker(self, job, args, work_dir, outfile, errfile, check_output, tool_name): 
+        try:
+            if container_type == 'Docker':
+                # TODO: add mount_list functionality for docker calls
+                return self.call_with_docker(job, args, work_dir, outfile, errfile, check_output, tool_name,
+                                             command=command)
+            elif container_type == 'Singularity':
+                return self.call_with_singularity(job, args, work_dir, outfile, errfile, check_output, tool_name, mount_list,
+                                                  command=command)
+            else:
+                return self.call_directly(args, work_dir, outfile, errfile, check_output, command=command)
+        finally:
+            if stderr_thread is not None:
+                # Close our end of the pipe so the logging thread sees EOF, and
+                # wait for it to log everything.
+                wfile.close()
+                stderr_thread.join()
+        
+    def call_with_docker(self, job, args, work_dir, outfile, errfile, check_output, tool_name, command=None): 
         """
         
         Thin wrapper for docker_call that will use internal lookup to
@@ -243,9 +451,13 @@ to do: Should go somewhere more central """
         Does support redirecting output to outfile, unless check_output is
         used, in which case output is captured.
         
+        command, if set, is the command as a string for logging.
+        
         """
 
-        RealtimeLogger.info(truncate_msg("Docker Run: {}".format(" | ".join(" ".join(x) for x in args))))
+        if command is None:
+            command = " | ".join(" ".join(x) for x in args)
+        RealtimeLogger.info(truncate_msg("Docker Run: {}".format(command)))
         start_time = timeit.default_timer()
 
         # we use the first argument to look up the tool in the docker map
@@ -264,6 +476,12 @@ to do: Should go somewhere more central """
         
         # And a working directory override
         working_dir = None
+        
+        # And the (stdout, stderr) of the command, if it is run with exec
+        exec_output = None
+        
+        # And whether stderr already went to errfile as the command ran
+        stderr_streamed = False
 
         # breaks Rscript.  Todo: investigate how general this actually is
         if name != 'Rscript':
@@ -283,7 +501,8 @@ to do: Should go somewhere more central """
         # ugly hack for platypus, as default container doesn't have executable in path
         if tool == 'quay.io/biocontainers/platypus-variant:0.8.1.1--htslib1.7_1' and \
            args[0][0] == 'Platypus.py':
-            args[0][0] = '/usr/local/share/platypus-variant-0.8.1.1-1/Platypus.py'
+            # (don't modify the caller's list)
+            args[0] = ['/usr/local/share/platypus-variant-0.8.1.1-1/Platypus.py'] + args[0][1:]
 
         # Force all dockers to run sort in a consistent way
         environment['LC_ALL'] = 'C'
@@ -298,286 +517,156 @@ to do: Should go somewhere more central """
 
             assert(not check_output)
             
-            # We can't just redirect stdout of the container from the API, so
-            # we do something more complicated.
-            
-            # Now we need to populate an FD that spits out the container output.
-            output_fd = None
-            
-            # We may be able to use a FIFO, or we may need a network connection.
-            # FIFO sharing between host and container only works on Linux.
-            use_fifo = (platform.system() == 'Linux')
-            
-            if use_fifo:
-                # On a Linux host we can just use a FIFO from the container to the host
-                
-                # Set up a FIFO to receive it
-                fifo_dir = tempfile.mkdtemp()
-                fifo_host_path = os.path.join(fifo_dir, 'stdout.fifo')
-                os.mkfifo(fifo_host_path)
-                
-                # Mount the FIFO in the container.
-                # The container doesn't actually have to have the mountpoint directory in its filesystem.
-                volumes[fifo_dir] = {'bind': '/control', 'mode': 'rw'}
-                
-                # Redirect the command output by tacking on another pipeline stage
-                parameters = args + [['dd', 'of=/control/stdout.fifo']]
-                
-                # Open the FIFO into nonblocking mode. See
-                # <https://stackoverflow.com/a/5749687> and
-                # <http://shallowsky.com/blog/programming/python-read-characters.html>
-                output_fd = os.open(fifo_host_path, os.O_RDONLY | os.O_NONBLOCK)
-                
+            if len(args) == 1:
+                # split off first argument as entrypoint (so we can be oblivious as to whether
+                # that happens by default)
+                parameters = args[0][1:]
+                entrypoint = args[0][0]
             else:
-                # On a Mac host we can't because of https://github.com/docker/for-mac/issues/483
-                # We need to go over the network instead.
-                
-                # Open an IPv4 TCP socket, since we know Docker uses IPv4 only
-                listen_sock = socket.socket(socket.AF_INET)
-                # Bind it to an OS-selected port on all interfaces, since we can't determine the Docker interface
-                # TODO: socket.INADDR_ANY ought to work here but is rejected for being an int.
-                listen_sock.bind(('', 0))
-                
-                # Start listening
-                listen_sock.listen(1)
-                
-                # Get the port we got given
-                listen_port = listen_sock.getsockname()[1]
-                
-                # Generate a random security cookie. Since we can't really stop
-                # Internet randos from connecting to our socket, we bail out on
-                # any connection that doesn't start with this cookie and a newline.
-                security_cookie = str(uuid.uuid4())
-                
-                # Redirect the command output to that port using Bash networking
-                # Your Docker needs to be 18.03+ to support host.docker.internal
-                # Your container needs to have bash with networking support
-                parameters = args + [['bash', '-c', 'exec 3<>/dev/tcp/host.docker.internal/{}; cat <(echo {}) - >&3'.format(
-                    listen_port, security_cookie)]]
-
-                RealtimeLogger.debug("Listening on port {} for output from Docker container".format(listen_port))
-                
-                # We can't populate the FD until we accept, which we can't do
-                # until the Docker comes up and is trying to connect.
-
-            RealtimeLogger.debug("Final Docker command: {}".format(" | ".join(" ".join(x) for x in parameters)))
-                
-            # Start the container detached so we don't wait on it
-            container = apiDockerCall(job, tool, parameters,
-                                      volumes=volumes,
-                                      working_dir=working_dir,
-                                      entrypoint=entrypoint,
-                                      environment=environment,
-                                      detach=True)
+                # run the pipeline through bash -c
+                parameters = args
             
-            RealtimeLogger.debug("Asked for container {}".format(container.id))
+            # Make the container, but don't start it until we are attached to
+            # its standard output. We can't go through the Docker logs, because
+            # they aren't safe for binary data, and we don't want to miss
+            # anything the container writes before we attach.
+            container = create_docker_container(job, tool, parameters,
+                                                volumes=volumes,
+                                                working_dir=working_dir,
+                                                entrypoint=entrypoint,
+                                                environment=environment)
+            # Kill and remove it at the end of the job if it is still around,
+            # for example because we failed while streaming its output.
+            job.defer(dockerKill, container.name, remove=True)
             
-            if not use_fifo:
-                # Try and accept a connection from the container.
-                # Make sure there's a timeout so we don't accept forever
-                listen_sock.settimeout(10)
-                
-                for attempt in range(3):
-                
-                    connection_sock, remote_address = listen_sock.accept()
-
-                    RealtimeLogger.info("Got connection from {}".format(remote_address))
-                    
-                    # Set a 10 second timeout for the cookie
-                    connection_sock.settimeout(10)
-                    
-                    # Check the security cookie
-                    received_cookie_and_newline = connection_sock.recv(len(security_cookie) + 1)
-                    
-                    if received_cookie_and_newline != security_cookie + "\n":
-                        # Incorrect security cookie.
-                        RealtimeLogger.warning("Received incorect security cookie message from {}".format(remote_address))
-                        continue
-                    else:
-                        # This is the container we are looking for
-                        # Go into nonblocking mode which our read code expects
-                        connection_sock.setblocking(True)
-                        # Set the FD
-                        output_fd = connection_sock.fileno()
-                        break
-
-                if output_fd is None:
-                    # We can't get ahold of the Docker in time
-                    raise RuntimeError("Could not establish network connection for Docker output!")
-                    
-            # If the Docker container goes badly enough, it may not even open
-            # the other end of the connection. So we can't just wait for it to
-            # EOF before checking on the Docker.
+            RealtimeLogger.debug("Asked for container {}".format(container.id))
             
-            # Now read ought to throw if there is no data. But
-            # <https://stackoverflow.com/q/38843278> and some testing suggest
-            # that this doesn't happen, and it just looks like EOF. So we will
-            # watch out for that.
+            output_stream = container.attach(stdout=True, stderr=False, stream=True, logs=False)
+            container.start()
             
             try:
-                # Prevent leaking FDs
+                for data in output_stream:
+                    # Send our data to the outfile
+                    outfile.write(data)
+            except:
+                # If the output can't be delivered (for example, because
+                # whatever reads the outfile has gone away), don't leave the
+                # command running.
+                try:
+                    container.kill()
+                except docker.errors.APIError:
+                    pass
+                raise
             
-                # If this is set, and there is no data in the pipe, decide that no data is coming
-                last_chance = False
-                # If this is set, we have seen data in the pipe, so the other
-                # end must have opened it and will eventually close it if it
-                # doesn't run forever.
-                saw_data = False
-                
-                while True:
-                    # While there still might be data in the pipe
-                    
-                    if output_fd is not None:
-                        # Select on the pipe with a timeout, so we don't spin constantly waiting for data
-                        can_read, can_write, had_error = select.select([output_fd], [], [output_fd], 10)
-                    
-                    if len(can_read) > 0 or len(had_error) > 0:
-                        # There is data available or something else weird about our FIFO.
-                    
-                        try:
-                            # Do a nonblocking read. Since we checked with select we never should get "" unless there's an EOF.
-                            data = os.read(output_fd, 4096)
-                            
-                            if len(data) == 0:
-                                # We didn't throw and we got nothing, so it must be EOF.
-                                RealtimeLogger.debug("Got EOF")
-                                break
-                                
-                        except OSError as err:
-                            if err.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
-                                # There is no data right now
-                                data = None
-                            else:
-                                # Something else has gone wrong
-                                raise err
-                                
-                    else:
-                        # There is no data available. Don't even try to read. Treat it as if a read refused to block.
-                        data = None
-                    
-                    if data and len(data) > 0:
-                        # Send our data to the outfile
-                        outfile.write(data)
-                        saw_data = True
-                    elif not saw_data:
-                        # We timed out and there has never been any data. Maybe the container has died/never started?
-                        
-                        if last_chance:
-                            # The container has been dead for a while and nothing has arrived yet. Assume no data is coming.
-                            RealtimeLogger.warning("Giving up on output form container {}".format(container.id))
-                            break
-                        
-                        # Otherwise, check on it
-                        container.reload()
-                        
-                        if container.status not in ['created', 'restarting', 'running', 'removing']:
-                            # The container has stopped. So what are we doing waiting around for it?
-                            
-                            # Wait one last time for any lingering data to percolate through the FIFO
-                            time.sleep(10)
-                            last_chance = True
-                            continue
-                            
-            finally:
-                # No matter what happens, close our end of the connection
-                os.close(output_fd)
-                
-                if not use_fifo:
-                    # Also close the listening socket
-                    listen_sock.close()
-                    
-                        
             # Now our data is all sent.
             # Wait on the container and get its return code.
             return_code = container.wait()
             
-            if use_fifo:
-                # Clean up the FIFO files
-                os.unlink(fifo_host_path)
-                os.rmdir(fifo_dir)
-            
         else:
-            # No piping needed.
+            # No piping needed, so we can exec the command in a long-lived
+            # container for this image and working directory, instead of
+            # making a new container for it.
         
             if len(args) == 1:
-                # split off first argument as entrypoint (so we can be oblivious as to whether
-                # that happens by default)
-                parameters = [] if len(args[0]) == 1 else args[0][1:]
-                entrypoint = args[0][0]
+                exec_command = args[0]
             else:
-                # can leave as is for piped interface which takes list of args lists
-                # and doesn't worry about entrypoints since everything goes through bash -c
-                # todo: check we have a bash entrypoint!
-                parameters = args
+                # run pipelines through bash -c, the same way apiDockerCall does
+                # todo: check we have a bash!
+                exec_command = ['/bin/bash', '-c', 'set -eo pipefail && {}'.format(
+                    ' | '.join(' '.join(shlex.quote(a) for a in x) for x in args))]
                 
-                
-            # Run the container and dump the logs if it fails.
-            container = apiDockerCall(job, tool, parameters,
-                                      volumes=volumes,
-                                      working_dir=working_dir,
-                                      entrypoint=entrypoint,
-                                      environment=environment,
-                                      detach=True)
-                                      
-            # Wait on the container and get its return code.
-            return_code = container.wait()
+            container = get_pooled_container(job, tool, volumes, working_dir,
+                                             os.path.abspath(work_dir) if work_dir is not None else None)
+            
+            # Run the command and stream its output as it comes. We only keep
+            # all of stdout if the caller wants it back, and otherwise just
+            # the ends of stdout and stderr, for logging if the command fails.
+            stdout_buffer = io.BytesIO() if check_output else OutputTail()
+            stderr_buffer = OutputTail()
+            def handle_output(stdout_data, stderr_data):
+                if stdout_data:
+                    stdout_buffer.write(stdout_data)
+                if stderr_data:
+                    stderr_buffer.write(stderr_data)
+                    if errfile:
+                        errfile.write(stderr_data)
+            return_code = exec_in_container(container, exec_command, handle_output,
+                                            environment=environment, workdir=working_dir)
+            exec_output = (stdout_buffer.getvalue(), stderr_buffer.getvalue())
+            stderr_streamed = errfile is not None
             
-        # When we get here, the container has been run, and stdout is either in the file object we sent it to or in the Docker logs.
-        # stderr is always in the Docker logs.
+        # When we get here, the container has been run, and stdout is either in the file object we sent it to,
+        # in the exec output, or in the Docker logs. stderr is in the exec output or the Docker logs.
         
         if isinstance(return_code, dict) and 'StatusCode' in return_code:
             # New? Docker gives us a dict like this
             return_code = return_code['StatusCode']
             
-        if return_code != 0:
-            # What were we doing?
-            command = " | ".join(" ".join(x) for x in args)
-        
-            # Dump logs
-            RealtimeLogger.error("Docker container for command {} failed with code {}".format(command, return_code))
-            RealtimeLogger.error("Dumping stderr...")
-            for line in container.logs(stderr=True, stdout=False, stream=True):
-                # Convert to string and trim trailing \n
-                RealtimeLogger.error(line.decode('utf-8', errors='replace')[:-1])
-                
-            if not check_output and outfile is None:
-                # Dump stdout as well, since it's not something the caller wanted as data
-                RealtimeLogger.error("Dumping stdout...")
-                for line in container.logs(stderr=False, stdout=True, stream=True):
-                    # Trim trailing \n
-                    RealtimeLogger.error(line[:-1])
-        
-            # Raise an error if it's not sucess
-            raise RuntimeError("Docker container for command {} failed with code {}".format(command, return_code))
-        elif errfile:
-            # user wants stderr even if no crash
-            for line in container.logs(stderr=True, stdout=False, stream=True):
-                errfile.write(line)
-        
-        if check_output:
-            # We need to collect the output. We grab it from Docker's handy on-disk buffer.
-            # TODO: Bad Things can happen if the container logs too much.
-            captured_stdout = container.logs(stderr=False, stdout=True)
+        def container_output(stdout=False, stderr=False, tail='all'):
+            """ Get the given output stream from the container or exec, as bytes """
+            if exec_output is not None:
+                data = (exec_output[0] if stdout else exec_output[1]) or b''
+                if tail != 'all':
+                    data = b''.join(data.splitlines(True)[-tail:])
+                return data
+            return container.logs(stdout=stdout, stderr=stderr, tail=tail)
+            
+        try:
+            if return_code != 0:
+                # Dump logs
+                RealtimeLogger.error("Docker container for command {} failed with code {}".format(command, return_code))
+                RealtimeLogger.error("Dumping stderr...")
+                log_output_error(container_output(stderr=True, tail=1000))
+                    
+                if not check_output and outfile is None:
+                    # Dump stdout as well, since it's not something the caller wanted as data
+                    RealtimeLogger.error("Dumping stdout...")
+                    log_output_error(container_output(stdout=True, tail=1000))
+            
+                # Raise an error if it's not sucess
+                raise RuntimeError("Docker container for command {} failed with code {}".format(command, return_code))
+            elif errfile and not stderr_streamed:
+                # user wants stderr even if no crash
+                errfile.write(container_output(stderr=True))
+            
+            if check_output:
+                # We need to collect the output. We grab it from the exec, or from Docker's handy on-disk buffer.
+                # TODO: Bad Things can happen if the container logs too much.
+                captured_stdout = container_output(stdout=True)
+        finally:
+            if exec_output is None:
+                # We made this container just for this command, and are done
+                # with its logs, so don't leave it behind.
+                try:
+                    container.remove(force=True)
+                except docker.errors.APIError as e:
+                    RealtimeLogger.warning("Could not remove container {}: {}".format(container.id, e))
             
         end_time = timeit.default_timer()
         run_time = end_time - start_time
         RealtimeLogger.info("Successfully docker ran {} in {} seconds.".format(
-            " | ".join(" ".join(x) for x in args), run_time))
+            command, run_time))
         
         if outfile:
+            # Make sure the output is written out of our buffers. We don't
+            # need to wait for it to hit the disk, since nothing reads it
+            # before it is closed or uploaded by Toil.
             outfile.flush()
-            os.fsync(outfile.fileno())
 
         if check_output is True:
             return captured_stdout
     
-    def call_with_singularity(self, job, args, work_dir, outfile, errfile, check_output, tool_name, mount_list): 
+    def call_with_singularity(self, job, args, work_dir, outfile, errfile, check_output, tool_name, mount_list,
+                              command=None): 
         """ Thin wrapper for singularity_call that will use internal lookup to
         figure out the location of the singularity file.  Only exposes singularity_call
         parameters used so far.  expect args as list of lists.  if (toplevel)
-        list has size > 1, then piping interface used """
+        list has size > 1, then piping interface used.  command, if set, is the
+        command as a string for logging """
 
-        RealtimeLogger.info(truncate_msg("Singularity Run: {}".format(" | ".join(" ".join(x) for x in args))))
+        if command is None:
+            command = " | ".join(" ".join(x) for x in args)
+        RealtimeLogger.info(truncate_msg("Singularity Run: {}".format(command)))
         start_time = timeit.default_timer()
 
         # we use the first argument to look up the tool in the singularity map
@@ -586,55 +675,44 @@ to do: Should go somewhere more central """
         tool = self.docker_tool_map[name]
         parameters = args[0] if len(args) == 1 else args
         
-        # Get a lock on the environment
-        global environment_lock
-        with environment_lock:
-            # TODO: We can't stop other threads using os.environ or subprocess or w/e on their own
-
-            # Set the locale to C for consistent sorting, and activate vg traceback     
-            update_env = {'LC_ALL' : 'C', 'VG_FULL_TRACEBACK': '1'}
-            if name == 'Rscript':
-                # The R dockers by default want to install packages in non-writable directories. Sometimes.
-                # Make sure a writable directory which exists is used.
-                update_env['R_LIBS']='/tmp'
-            old_env = {}
-            for env_name, env_val in list(update_env.items()):
-                old_env[env_name] = os.environ.get(env_name)
-                os.environ[env_name] = env_val
-            
-            if check_output is True:
-                ret = singularityCheckOutput(job, tool, parameters=parameters, workDir=work_dir, mount_list=mount_list)
-            else:
-                ret = singularityCall(job, tool, parameters=parameters, workDir=work_dir, outfile = outfile, mount_list=mount_list)
-            
-            # Restore old locale and vg traceback
-            for env_name, env_val in list(update_env.items()):
-                if old_env[env_name] is not None:
-                    os.environ[env_name] = old_env[env_name]
-                else:
-                    del os.environ[env_name]
+        # Set the locale to C for consistent sorting, and activate vg traceback
+        environment = {'LC_ALL' : 'C', 'VG_FULL_TRACEBACK': '1'}
+        if name == 'Rscript':
+            # The R dockers by default want to install packages in non-writable directories. Sometimes.
+            # Make sure a writable directory which exists is used.
+            environment['R_LIBS']='/tmp'
+        
+        if check_output is True:
+            ret = singularityCheckOutput(job, tool, parameters=parameters, workDir=work_dir, mount_list=mount_list,
+                                         environment=environment)
+        else:
+            ret = singularityCall(job, tool, parameters=parameters, workDir=work_dir, outfile = outfile, mount_list=mount_list,
+                                  environment=environment)
         
         end_time = timeit.default_timer()
         run_time = end_time - start_time
         RealtimeLogger.info("Successfully singularity ran {} in {} seconds.".format(
-            " | ".join(" ".join(x) for x in args), run_time))
+            command, run_time))
 
         if outfile:
+            # Make sure the output is written out of our buffers. We don't
+            # need to wait for it to hit the disk, since nothing reads it
+            # before it is closed or uploaded by Toil.
             outfile.flush()
-            os.fsync(outfile.fileno())
         
         return ret
 
-    def call_directly(self, args, work_dir, outfile, errfile, check_output):
-        """ Just run the command without docker """
+    def call_directly(self, args, work_dir, outfile, errfile, check_output, command=None):
+        """ Just run the command without docker. command, if set, is the command
+        as a string for logging """
 
-        RealtimeLogger.info(truncate_msg("Run: {}".format(" | ".join(" ".join(x) for x in args))))
+        if command is None:
+            command = " | ".join(" ".join(x) for x in args)
+        RealtimeLogger.info(truncate_msg("Run: {}".format(command)))
         start_time = timeit.default_timer()
 
         # Set up the child's environment
-        global environment_lock
-        with environment_lock:
-            my_env = os.environ.copy()
+        my_env = os.environ.copy()
             
         # vg uses TMPDIR for temporary files
         # this is particularly important for gcsa, which makes massive files.
@@ -652,6 +730,9 @@ to do: Should go somewhere more central """
             stdin = procs[i-1].stdout if i > 0 else None
             if i == len(args) - 1 and outfile is not None:
                 stdout = outfile
+            elif i == len(args) - 1 and not check_output:
+                # Nobody wants this output, so don't pipe it back just to drop it
+                stdout = subprocess.DEVNULL
             else:
                 stdout = subprocess.PIPE
 
@@ -679,15 +760,25 @@ to do: Should go somewhere more central """
         end_time = timeit.default_timer()
         run_time = end_time - start_time
         RealtimeLogger.info("Successfully ran {} in {} seconds.".format(
-            " | ".join(" ".join(x) for x in args), run_time))            
+            command, run_time))            
         
         if outfile:
+            # Make sure the output is written out of our buffers. We don't
+            # need to wait for it to hit the disk, since nothing reads it
+            # before it is closed or uploaded by Toil.
             outfile.flush()
-            os.fsync(outfile.fileno())
 
         if check_output:
             return output
 
+@lru_cache(maxsize=None)
+def get_vg_scripts_path():
+    """
+    Get the scripts directory of the vg in our PATH. Searching the PATH takes
+    a stat per entry, so we only do it once.
+    """
+    return os.path.join(os.path.dirname(find_executable('vg')), '..', 'scripts')
+
 def get_vg_script(job, runner, script_name, work_dir):
     """
     getting the path to a script in vg/scripts is different depending on if we're
@@ -697,13 +788,24 @@ def get_vg_script(job, runner, script_name, work_dir):
     vg_container_type = runner.container_for_tool('vg')
 
     if vg_container_type != 'None':
-        # we copy the scripts out of the container, assuming vg is at /vg
-        cmd = ['cp', os.path.join('/vg', 'scripts', script_name), '.']
-        runner.call(job, cmd, work_dir = work_dir, tool_name='vg')
+        vg_image = runner.docker_tool_map['vg']
+        with vg_script_cache_lock:
+            if vg_image not in vg_script_cache_dirs:
+                # we copy all the scripts out of the container at once, assuming vg is at /vg,
+                # so we never need to start a container to get a script from this image again.
+                # They go through the work_dir, since we know the container can mount that.
+                copy_dir = tempfile.mkdtemp(dir=work_dir)
+                cmd = ['cp', '-r', os.path.join('/vg', 'scripts'), os.path.basename(copy_dir)]
+                runner.call(job, cmd, work_dir = work_dir, tool_name='vg')
+                cache_dir = tempfile.mkdtemp(prefix='toil-vg-scripts-')
+                atexit.register(shutil.rmtree, cache_dir, True)
+                shutil.move(os.path.join(copy_dir, 'scripts'), os.path.join(cache_dir, 'scripts'))
+                shutil.rmtree(copy_dir)
+                vg_script_cache_dirs[vg_image] = os.path.join(cache_dir, 'scripts')
+        shutil.copy2(os.path.join(vg_script_cache_dirs[vg_image], script_name), os.path.join(work_dir, script_name))
     else:
         # we copy the script from the vg directory in our PATH
-        scripts_path = os.path.join(os.path.dirname(find_executable('vg')), '..', 'scripts')
-        shutil.copy2(os.path.join(scripts_path, script_name), os.path.join(work_dir, script_name))
+        shutil.copy2(os.path.join(get_vg_scripts_path(), script_name), os.path.join(work_dir, script_name))
     return os.path.join(work_dir, script_name)
 
 def set_r_cran_url(script_path):
@@ -728,25 +830,22 @@ def set_r_cran_url(script_path):
                 fixed = True    
                             
 def get_files_by_file_size(dirname, reverse=False):
-    """ Return list of file paths in directory sorted by file size """
+    """ Return list of (file path, size) tuples in directory sorted by file size """
 
-    # Get list of files
-    filepaths = []
-    for basename in os.listdir(dirname):
-        filename = os.path.join(dirname, basename)
-        if os.path.isfile(filename):
-            filepaths.append(filename)
+    # Get list of files with their sizes, using the file type and stat info
+    # we get from scanning the directory
+    with os.scandir(dirname) as entries:
+        filepaths = [(entry.path, entry.stat().st_size) for entry in entries if entry.is_file()]
 
-    # Re-populate list with filename, size tuples
-    for i in range(len(filepaths)):
-        filepaths[i] = (filepaths[i], os.path.getsize(filepaths[i]))
-
-    return filepaths
+    return sorted(filepaths, key=lambda x: x[1], reverse=reverse)
 
 def make_url(path):
     """ Turn filenames into URLs, whileleaving existing URLs alone """
-    # local path
-    if ':' not in path:
+    # A URL has a scheme followed by a path, so file:/x and file:///x are both
+    # URLs, but a local path like sample:1.vg (with a colon in it somewhere)
+    # is not.
+    scheme = urlparse(path).scheme
+    if not scheme or not path[len(scheme) + 1:].startswith('/'):
         return 'file://' + os.path.abspath(path)
     else:
         return path
@@ -766,13 +865,9 @@ def parse_id_ranges(job, id_ranges_file_id):
 def parse_id_ranges_file(id_ranges_filename):
     """Returns list of triples chrom, start, end
     """
-    id_ranges = []
     with open(id_ranges_filename) as f:
-        for line in f:
-            toks = line.split()
-            if len(toks) == 3:
-                id_ranges.append((toks[0], int(toks[1]), int(toks[2])))
-    return id_ranges
+        lines = f.read().splitlines()
+    return [(toks[0], int(toks[1]), int(toks[2])) for toks in map(str.split, lines) if len(toks) == 3]
 
 def remove_ext(string, ext=None):
     """
@@ -780,11 +875,10 @@ def remove_ext(string, ext=None):
     If no suffix given, strips the last . and everything after (like file extension)
     """
     if ext is None:
-        if string.rfind('.') >= 0:
-            ext = string[string.rfind('.'):]
-        else:
-            ext =""
-    if string.lower().endswith(ext.lower()):
+        dot_pos = string.rfind('.')
+        return string[:dot_pos] if dot_pos >= 0 else string
+    # only case-fold the end of the string we are comparing against
+    if ext and string[-len(ext):].lower() == ext.lower():
         return string[:-len(ext)]
     else:
         return string
@@ -803,9 +897,10 @@ def truncate_msg(msg, max_len=2000):
 
 class TimeTracker:
     """ helper dictionary to keep tabs on several named runtimes. """
+    __slots__ = ('times', 'running')
     def __init__(self, name = None):
         """ create. optionally start a timer"""
-        self.times = collections.defaultdict(float)
+        self.times = {}
         self.running = {}
         if name:
             self.start(name)
@@ -818,16 +913,15 @@ class TimeTracker:
         names = [name] if name else list(self.running.keys())
         ti = timeit.default_timer()
         for name in names:
-            self.times[name] += ti - self.running[name]
-            del self.running[name]
+            self.times[name] = self.times.get(name, 0.0) + ti - self.running.pop(name)
     def add(self, time_dict):
         """ add in all times from another TimeTracker """
-        for key, value in list(time_dict.times.items()):
-            self.times[key] += value
+        for key, value in time_dict.times.items():
+            self.times[key] = self.times.get(key, 0.0) + value
     def total(self, names = None):
         if not names:
-            names = list(self.times.keys())
-        return sum([self.times[name] for name in names])
+            return math.fsum(self.times.values())
+        return math.fsum(self.times.get(name, 0.0) for name in names)
     def names(self):
         return list(self.times.keys())
         
@@ -842,6 +936,7 @@ def run_concat_lists(job, *args):
         concat += input_list
     return concat
     
+@lru_cache(maxsize=None)
 def parse_plot_set(plot_set_string):
     """
     
@@ -853,24 +948,22 @@ def parse_plot_set(plot_set_string):
     
     The first condition is the comparison baseline, when applicable.
     
-    Returns a tuple of a plot set title, or None if unspecified, and a list of
-    condition names.
+    Returns a tuple of a plot set title, or None if unspecified, and a tuple of
+    condition names. Results are cached, so they must not be modified.
     
     """
     
-    colon_pos = plot_set_string.find(':')
+    # Split off the title before the colon, and the rest of the specifier after it
+    title, colon, conditions = plot_set_string.partition(':')
     
-    if colon_pos != -1:
-        # Pull out the title before the colon
-        title = plot_set_string[0:colon_pos]
-        # And the rest of the specifier after it
-        plot_set_string = plot_set_string[colon_pos + 1:]
+    if colon:
+        plot_set_string = conditions
     else:
         # No title given
         title = None
         
-    # Return the title and condition list tuple
-    return (title, plot_set_string.split(','))
+    # Return the title and condition tuple
+    return (title, tuple(plot_set_string.split(',')))
         
     
 def parse_plot_sets(plot_sets_list):
@@ -878,8 +971,8 @@ def parse_plot_sets(plot_sets_list):
     
     Given a list of plot set strings, parses each with parse_plot_set.
     
-    Returns a list of tuples. Each tuple is a plot set title, or None if no
-    title is to be applied, and a list of condition names, or None if all
+    Returns a tuple of tuples. Each tuple is a plot set title, or None if no
+    title is to be applied, and a tuple of condition names, or None if all
     conditions are to be included.
     
     If no plot sets are specified in the list, returns a single plot set for
@@ -887,15 +980,19 @@ def parse_plot_sets(plot_sets_list):
     
     """
     
-    plot_sets = [parse_plot_set(spec) for spec in plot_sets_list]
+    plot_sets = tuple(parse_plot_set(spec) for spec in plot_sets_list)
     if len(plot_sets) == 0:
         # We want to plot everything together
         # We use the special None value instead of a condition list to request that.
         # And we use None for the title.
-        plot_sets = [(None, None)]
+        plot_sets = ((None, None),)
     
     return plot_sets
     
+# Deletion table for the ASCII characters we don't want in filenames
+unsafe_filename_chars = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not chr(c).isalnum()))
+
+@lru_cache(maxsize=1024)
 def title_to_filename(kind, i, title, extension):
     """
     Given the kind of thing you want to save ('table', 'plot-qq', etc.), the
@@ -908,12 +1005,6 @@ def title_to_filename(kind, i, title, extension):
     The extension may be None, in which case it is omitted.
     """
     
-    if title is not None:
-        # Filter down to good filename characters as in https://stackoverflow.com/a/7406369
-        safe_title = ''.join((c for c in title if c.isalnum()))
-    else:
-        safe_title = None
-        
     # The name always includes the kind of thing
     part_list = [kind]
     
@@ -926,7 +1017,10 @@ def title_to_filename(kind, i, title, extension):
         
     if title is not None:
         # Filter down to good filename characters as in https://stackoverflow.com/a/7406369
-        safe_title = ''.join((c for c in title if c.isalnum()))
+        safe_title = title.translate(unsafe_filename_chars)
+        if not safe_title.isascii():
+            # The table only covers ASCII, so check the rest one at a time
+            safe_title = ''.join((c for c in safe_title if c.isalnum()))
         part_list.append('-{}'.format(safe_title))
         
     if extension is not None:
@@ -934,6 +1028,38 @@ def title_to_filename(kind, i, title, extension):
         
     return ''.join(part_list)
     
+@contextmanager
+def staged_files(job, file_ids):
+    """
+    Context manager to get a fresh work directory with some files from the
+    file store in it.
+    
+    Takes a dict from local file name to file ID. Yields the work directory
+    and a dict from each local file name to the full path it was downloaded
+    to.
+    
+    When the block exits, the downloaded copies are dropped, so big inputs
+    don't use up the job's disk for the rest of the job. Other files written
+    to the work directory are left alone.
+    """
+    
+    work_dir = job.fileStore.getLocalTempDir()
+    
+    paths = {}
+    for name, file_id in file_ids.items():
+        paths[name] = os.path.join(work_dir, name)
+        job.fileStore.readGlobalFile(file_id, paths[name])
+        
+    try:
+        yield work_dir, paths
+    finally:
+        for file_id in file_ids.values():
+            # Let the file store know we are done with its copies
+            try:
+                job.fileStore.deleteLocalFile(file_id)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
     
 def ensure_disk(job, job_fn, job_fn_args, job_fn_kwargs, file_id_list, factor=8, padding=1024 ** 3):
     """
@@ -1022,10 +1148,16 @@ def run_concat_files(job, context, file_ids, dest_name=None, header=None):
 class AsyncImporter(object):
     """ 
     Importing big files is a bottleneck.  We can improve things somewhat by using threads
+    
+    We use threads rather than asyncio because Toil.importFile is a blocking
+    call that owns the job store protocol; uploading behind its back with an
+    async S3 or HTTP client would produce files the job store doesn't know about.
     """
-    def __init__(self, toil, max_threads = multiprocessing.cpu_count(),
-                 retry_count = 3):
+    def __init__(self, toil, max_threads = min(16, multiprocessing.cpu_count()),
+                 retry_count = 3, progress_interval = 60):
         self.toil = toil
+        # How often wait() should log how many imports are done, in seconds
+        self.progress_interval = progress_interval
         self.threads = max_threads
         self.retry_count = retry_count
         if not isinstance(self.toil._jobStore, FileJobStore):
@@ -1036,6 +1168,9 @@ class AsyncImporter(object):
             # Will only activate on Google and Azure after testing! 
             self.threads = 1
         self.executor = ThreadPoolExecutor(max_workers = self.threads)
+        self.futures = []
+        # Map from URL to the Future for its import, so repeated loads share it
+        self.cache = {}
         self.start_time = timeit.default_timer()
         self.count = 0
         logger.info('Importing input files into Toil')
@@ -1044,8 +1179,13 @@ class AsyncImporter(object):
         """ 
         Do a toil import asynchronously.  vg construct will actually fail if the tbi is 
         imported after the vcf.gz, so the wait_on option is used, for example,
-        to make sure indexes get imported after the file they index 
+        to make sure indexes get imported after the file they index.  Loading
+        the same URL more than once returns the Future from the first load
+        rather than importing the file again.
         """
+        url = urlparse(file_path).geturl()
+        if url in self.cache:
+            return self.cache[url]
         self.count += 1
         def wait_import():
             if wait_on:
@@ -1061,13 +1201,39 @@ class AsyncImporter(object):
                         raise
                     else:
                         time.sleep(i)
-        return self.executor.submit(wait_import)
+        future = self.executor.submit(wait_import)
+        self.futures.append(future)
+        self.cache[url] = future
+        return future
 
     def wait(self):
         """ 
-        Wait until everything's finished running.  Doesn't do much, in effect, beyond
-        the log message...
+        Wait until everything's finished running, logging progress every
+        progress_interval seconds.  If any import fails, cancel the ones that
+        haven't started yet and raise its error right away instead of waiting
+        for the rest of the uploads.
         """
+        while True:
+            done, not_done = wait_futures(self.futures, timeout = self.progress_interval,
+                                          return_when = FIRST_EXCEPTION)
+            if not not_done or any(future.exception() is not None for future in done):
+                break
+            # Still going, so say how far along we are in case a big upload
+            # looks stalled.
+            logger.info('Imported {} of {} input files into Toil after {} seconds'.format(
+                len(done), len(self.futures), timeit.default_timer() - self.start_time))
+        for future in done:
+            if future.exception() is not None:
+                # Don't block on the uploads already running; just drop the
+                # ones still queued and report the failure.
+                try:
+                    self.executor.shutdown(wait = False, cancel_futures = True)
+                except TypeError:
+                    # Python before 3.9 has no cancel_futures
+                    for other in not_done:
+                        other.cancel()
+                    self.executor.shutdown(wait = False)
+                raise future.exception()
         self.executor.shutdown(wait = True)
         end_time = timeit.default_timer()
         logger.info('Imported {} input files into Toil in {} seconds'.format(
@@ -1077,13 +1243,16 @@ class AsyncImporter(object):
         """ 
         Transform our promises to values.
         Supports lists, tuples, dicts and Namespaces and some nested combos thereof
+        
+        Resolving is cheap to repeat: each Future keeps its result once the
+        import finishes, and a URL loaded more than once shares one Future.
         """
         if result is None:
             return None
         elif isinstance(result, (list, tuple)):
             return [self.resolve(x) for x in result]
         elif isinstance(result, dict):
-            return dict([(k,self.resolve(v)) for k,v in list(result.items())])
+            return {k: self.resolve(v) for k, v in result.items()}
         elif isinstance(result, argparse.Namespace):
             result.__dict__ = self.resolve(result.__dict__)
             return result
@@ -4,7 +4,7 @@ vg_index.py: index a graph so it can be mapped to
 
 """
 
-import argparse, sys, os, os.path, errno, random, subprocess, shutil, itertools, glob, tarfile
+import argparse, sys, os, os.path, errno, random, subprocess, shutil, itertools, tarfile
 import doctest, re, json, collections, time, timeit, distutils.util
 import logging, logging.handlers, struct, socket, threading
 import string
@@ -971,9 +971,11 @@ def run_bwa_index(job, context, fasta_file_id, bwa_index_ids=None, intermediate=
         # Work out how to output the files
         write_file = context.write_intermediate_file if intermediate else context.write_output_file
         
-        for idx_file in glob.glob('{}.*'.format(fasta_file)):
-            # Upload all the index files created, and store their IDs under their extensions
-            bwa_index_ids[idx_file[len(fasta_file):]] = write_file(job, idx_file)
+        fasta_name = os.path.basename(fasta_file)
+        for entry in os.scandir(work_dir):
+            if entry.name.startswith(fasta_name + '.'):
+                # Upload all the index files created, and store their IDs under their extensions
+                bwa_index_ids[entry.name[len(fasta_name):]] = write_file(job, entry.path)
             
         if copy_fasta and not intermediate:
             # We ought to upload the FASTA also.
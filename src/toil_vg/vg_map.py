@@ -113,6 +113,19 @@ def map_parse_args(parser, stand_alone = False):
                         help="Path to file with node id ranges for each chromosome in BED format.")
 
     
+def mpmap_outputs_gam(mpmap_opts):
+    """
+    Return True if the given list of vg mpmap options selects GAM output with
+    -F/--output-fmt. The last format given wins, as it does in vg.
+    """
+    output_fmt = None
+    for i, opt in enumerate(mpmap_opts):
+        if opt in ('-F', '--output-fmt') and i + 1 < len(mpmap_opts):
+            output_fmt = mpmap_opts[i + 1]
+        elif opt.startswith('--output-fmt='):
+            output_fmt = opt[len('--output-fmt='):]
+    return output_fmt == 'GAM'
+
 def validate_map_options(context, options):
     """
     Throw an error if an invalid combination of options has been selected.
@@ -139,7 +152,7 @@ def validate_map_options(context, options):
     require(options.mapper == 'mpmap' or options.snarls_index is None,
             '--snarls_index can only be used with --mapper mpmap') 
     if options.mapper == 'mpmap':
-        require(('-F' in context.config.mpmap_opts or '--output-fmt' in context.config.mpmap_opts) and ('GAM' in context.config.mpmap_opts),
+        require(mpmap_outputs_gam(context.config.mpmap_opts),
                 '-F GAM must be used with mpmap mapper to produce GAM output')
         require(not options.bam_output,
                 '--bam_output not currently supported with mpmap mapper')
@@ -298,7 +311,11 @@ def run_split_fastq(job, context, fastq, fastq_i, sample_fastq_id):
 
     # Note we do this on the command line because Python is too slow
     if fastq_gzipped:
-        cmd = [['gzip', '-d', '-c', os.path.basename(fastq_path)]]
+        # pigz is already in the container for the chunk filter below, and
+        # decompresses faster than gzip by doing I/O and checksumming on
+        # separate threads.
+        cmd = [['pigz', '-d', '-c', '-p', str(max(1, int(context.config.fq_split_cores))),
+                os.path.basename(fastq_path)]]
     else:
         cmd = [['cat', os.path.basename(fastq_path)]]
 
@@ -556,7 +573,7 @@ def run_chunk_alignment(job, context, gam_input_reads, bam_input_reads, sample_n
         if mapper == 'mpmap':
             vg_parts += ['vg', 'mpmap']
             vg_parts += context.config.mpmap_opts
-            if ('-F' not in vg_parts and '--output-fmt' not in vg_parts) or 'GAM' not in vg_parts:
+            if not mpmap_outputs_gam(context.config.mpmap_opts):
                 RealtimeLogger.warning('Adding --output-fmt GAM to mpmap options as only GAM output supported')
                 vg_parts += ['--output-fmt', 'GAM']
         elif mapper == 'map':
@@ -5,39 +5,32 @@ that was created with vg sim --gam
 
 """
 
-import argparse, sys, os, os.path, errno, random, subprocess, shutil, itertools, glob, tarfile
-import doctest, re, json, collections, time, timeit
-import logging, logging.handlers, struct, socket, threading
-import string, math
-import getpass
-import pdb
-import gzip
-import logging
+import argparse, sys, os, os.path, errno, shutil, itertools
+import json, collections, time, timeit
+import logging, threading
+import platform
+import math
 import copy
 from collections import Counter
 
-from math import ceil
-from subprocess import Popen, PIPE
 from functools import reduce
 
 try:
-    import numpy as np
-    from sklearn.metrics import roc_auc_score, average_precision_score, r2_score, roc_curve
+    from sklearn.metrics import roc_auc_score, average_precision_score, r2_score
     have_sklearn = True
 except:
     have_sklearn = False
 
 import tsv
 
-from toil.common import Toil
 from toil.job import Job
 from toil.realtimeLogger import RealtimeLogger
-from toil_vg.vg_common import require, make_url, remove_ext,\
+from toil_vg.vg_common import require, make_url, \
     add_common_vg_parse_args, add_container_tool_parse_args, get_vg_script, run_concat_lists, \
-    parse_plot_sets, title_to_filename, ensure_disk, run_concat_files, AsyncImporter, set_r_cran_url
+    parse_plot_sets, title_to_filename, staged_files, ensure_disk, run_concat_files, AsyncImporter, set_r_cran_url
 from toil_vg.vg_map import map_parse_args, run_split_reads_if_needed, run_mapping
 from toil_vg.vg_index import run_indexing, run_bwa_index, run_minimap2_index
-from toil_vg.context import Context, run_write_info_to_outstore
+from toil_vg.context import run_write_info_to_outstore
 
 logger = logging.getLogger(__name__)
 
@@ -120,6 +113,9 @@ def add_mapeval_options(parser):
                         help='arguments for minimap2 (wrapped in \"\").')
     parser.add_argument('--fasta', type=make_url, default=None,
                         help='fasta sequence file (required for bwa or minimap2. If .fa.* indexes exists for this file, they will be used)')
+    parser.add_argument('--save-bwa-index', action='store_true',
+                        help='save any bwa index built from --fasta to the out store, as bwa.fa and bwa.fa.*, '
+                        'so later runs can use them with --fasta instead of rebuilding')
    
     
     # We can compare all the scores against those from a particular GAM, if asked.
@@ -131,6 +127,8 @@ def add_mapeval_options(parser):
                         
     parser.add_argument('--downsample', type=float, default=None,
                         help='downsample alignment files to the given portion of reads for evaluation')
+    parser.add_argument('--stats-batch-size', type=int, default=1,
+                        help='extract read stats from up to this many BAMs in each job, to save per-job overhead on small BAMs')
 
     parser.add_argument('--ignore-quals', action='store_true',
                         help='never use quality adjusted alignment. ' 
@@ -339,6 +337,24 @@ def run_bam_to_fastq(job, context, bam_file_id, paired_mode, add_paired_suffix=F
             context.runner.call(job, cmd, work_dir = work_dir, outfile = sim_file)
         return [context.write_intermediate_file(job, sim_fq_file)]
     
+def split_paired_json(json_file, end_1_file, end_2_file):
+    """
+    Split a file of JSON alignments, one per line, into two files by end of
+    pair, according to the _1 or _2 suffix on each read name. Reads with
+    neither suffix are dropped.
+    """
+    
+    with open(json_file, 'rb') as json_in, open(end_1_file, 'wb') as end_1_out, \
+        open(end_2_file, 'wb') as end_2_out:
+        for line in json_in:
+            if not line.strip():
+                continue
+            read_name = json.loads(line).get('name', '')
+            if read_name.endswith('_1'):
+                end_1_out.write(line)
+            elif read_name.endswith('_2'):
+                end_2_out.write(line)
+
 def run_gam_to_fastq(job, context, gam_file_id, paired_mode,
                      add_paired_suffix=False, out_name = 'sim', out_store = False, ):
     """
@@ -357,7 +373,7 @@ def run_gam_to_fastq(job, context, gam_file_id, paired_mode,
     
     # if we're paired, must make some split files
     if paired_mode:
-        # convert to json (todo: have docker image that can do vg and jq)
+        # convert to json, one alignment per line
         json_file = gam_file + '.json'
         cmd = ['vg', 'view', '-a', os.path.basename(gam_file)]
         with open(json_file, 'wb') as out_json:
@@ -366,14 +382,16 @@ def run_gam_to_fastq(job, context, gam_file_id, paired_mode,
         sim_fq_files = [None, os.path.join(work_dir, '{}_1{}.fq.gz'.format(out_name, 's' if add_paired_suffix else '')),
                         os.path.join(work_dir, '{}_2{}.fq.gz'.format(out_name, 's' if add_paired_suffix else ''))]
 
+        # split the reads up by end of pair, in one pass over the JSON
+        end_files = [None] + [json_file + '.{}'.format(i) for i in [1, 2]]
+        split_paired_json(json_file, end_files[1], end_files[2])
+        
+        # get rid of that big json asap
+        os.remove(json_file)
+
         # make a fastq for each end of pair
         for i in [1, 2]:
-            # extract paired end with jq
-            cmd = ['jq', '-cr', 'select(.name | test("_{}$"))'.format(i),
-                   os.path.basename(json_file)]
-            end_file = json_file + '.{}'.format(i)
-            with open(end_file, 'wb') as end_out:
-                context.runner.call(job, cmd, work_dir = work_dir, outfile = end_out)
+            end_file = end_files[i]
 
             cmd = [['vg', 'view', '-JaG', os.path.basename(end_file)]]
             cmd.append(['vg', 'view', '-X', '-'])
@@ -448,6 +466,89 @@ def run_strip_fq_ext(job, context, fq_reads_ids):
 
     return out_ids
     
+def call_into_bam(job, context, cmd, work_dir, bam_file, samtools_timeout=600):
+    """
+    Run the given SAM-producing command in work_dir, and convert its output
+    into a BAM at bam_file with samtools, dropping secondary and supplementary
+    alignments.
+    
+    The command and samtools may need different containers, so they can't be
+    one pipeline. Instead the SAM goes through a named pipe in work_dir, so it
+    never has to be written to disk. FIFOs don't work between the host and
+    Docker for Mac (https://github.com/docker/for-mac/issues/483), so there we
+    fall back to a temporary SAM file.
+    
+    samtools_timeout is how long to wait, in seconds, for samtools to finish
+    once the command's output has all been sent.
+    """
+    
+    sam_file = bam_file + '.sam'
+    # 2304 = get rid of 256 (secondary) + 2048 (supplementary)
+    samtools_cmd = ['samtools', 'view', '-1', '-F', '2304', os.path.basename(sam_file)]
+    
+    if platform.system() == 'Darwin' and context.runner.container_for_tool('samtools') == 'Docker':
+        with open(sam_file, 'wb') as out_sam:
+            context.runner.call(job, cmd, work_dir = work_dir, outfile = out_sam)
+        with open(bam_file, 'wb') as out_bam:
+            context.runner.call(job, samtools_cmd, work_dir = work_dir, outfile = out_bam)
+        os.remove(sam_file)
+        return
+    
+    os.mkfifo(sam_file)
+    
+    # samtools reads the pipe in the background, and any error it raises is kept here
+    samtools_errors = []
+    
+    def run_samtools():
+        try:
+            with open(bam_file, 'wb') as out_bam:
+                context.runner.call(job, samtools_cmd, work_dir = work_dir, outfile = out_bam)
+        except Exception as e:
+            samtools_errors.append(e)
+    
+    samtools_thread = threading.Thread(target=run_samtools)
+    samtools_thread.daemon = True
+    samtools_thread.start()
+    
+    sam_fd = None
+    try:
+        # Opening a pipe for writing blocks until someone opens it for
+        # reading, which would hang forever if samtools fails to start. So
+        # poll for the reader instead.
+        while True:
+            try:
+                sam_fd = os.open(sam_file, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                if not samtools_thread.is_alive():
+                    raise samtools_errors[0] if samtools_errors else RuntimeError('samtools did not read SAM input')
+                time.sleep(0.1)
+        os.set_blocking(sam_fd, True)
+        
+        # If samtools dies partway through, writing to the pipe fails, and
+        # the runner stops the command instead of leaving it running.
+        with os.fdopen(sam_fd, 'wb') as out_sam:
+            context.runner.call(job, cmd, work_dir = work_dir, outfile = out_sam)
+    finally:
+        if sam_fd is None:
+            # We never opened the writing end, so samtools may still be
+            # blocked opening the pipe. Open and close a writer to give it an
+            # empty input, so it exits.
+            try:
+                os.close(os.open(sam_file, os.O_RDWR | os.O_NONBLOCK))
+            except OSError:
+                pass
+        # Closing our end lets samtools see the end of the SAM
+        samtools_thread.join(samtools_timeout)
+        os.remove(sam_file)
+        
+    if samtools_thread.is_alive():
+        raise RuntimeError('samtools did not finish within {} seconds of the end of its input'.format(samtools_timeout))
+    if samtools_errors:
+        raise samtools_errors[0]
+
 def run_bwa_mem(job, context, fq_reads_ids, bwa_index_ids, paired_mode):
     """ run bwa-mem on reads in a fastq.  optionally run in paired mode
     return id of bam file
@@ -494,8 +595,7 @@ def run_bwa_mem(job, context, fq_reads_ids, bwa_index_ids, paired_mode):
             cmd += ['-p']
         cmd += context.config.bwa_opts
         
-        with open(bam_file + '.sam', 'wb') as out_sam:
-            context.runner.call(job, cmd, work_dir = work_dir, outfile = out_sam)
+        call_into_bam(job, context, cmd, work_dir, bam_file)
 
         end_time = timeit.default_timer()
         run_time = end_time - start_time
@@ -504,12 +604,6 @@ def run_bwa_mem(job, context, fq_reads_ids, bwa_index_ids, paired_mode):
         # report        
         RealtimeLogger.info("Aligned aligned-linear_0.gam. Process took {} seconds with paired-end bwa-mem".format(
             run_time))
-            
-        # separate samtools for docker (todo find image with both)
-        # 2304 = get rid of 256 (secondary) + 2048 (supplementary)        
-        cmd = ['samtools', 'view', '-1', '-F', '2304', os.path.basename(bam_file + '.sam')]
-        with open(bam_file, 'wb') as out_bam:
-            context.runner.call(job, cmd, work_dir = work_dir, outfile = out_bam)
 
     # single end
     else:
@@ -520,8 +614,7 @@ def run_bwa_mem(job, context, fq_reads_ids, bwa_index_ids, paired_mode):
         cmd = ['bwa', 'mem', '-t', str(context.config.alignment_cores), os.path.basename(fasta_file),
                 os.path.basename(fq_file_names[0])] + context.config.bwa_opts
 
-        with open(bam_file + '.sam', 'wb') as out_sam:
-            context.runner.call(job, cmd, work_dir = work_dir, outfile = out_sam)
+        call_into_bam(job, context, cmd, work_dir, bam_file)
 
         end_time = timeit.default_timer()
         run_time = end_time - start_time
@@ -531,13 +624,6 @@ def run_bwa_mem(job, context, fq_reads_ids, bwa_index_ids, paired_mode):
         RealtimeLogger.info("Aligned aligned-linear_0.gam. Process took {} seconds with single-end bwa-mem".format(
             run_time))            
 
-        # separate samtools for docker (todo find image with both)
-        # 2304 = get rid of 256 (secondary) + 2048 (supplementary)
-        cmd = ['samtools', 'view', '-1', '-F', '2304', os.path.basename(bam_file + '.sam')]
-        with open(bam_file, 'wb') as out_bam:
-            context.runner.call(job, cmd, work_dir = work_dir, outfile = out_bam)
-
-
     # return our id for the output bam file
     bam_file_id = context.write_output_file(job, bam_file)
 
@@ -719,19 +805,24 @@ def extract_bam_read_stats(job, context, name, bam_file_id, paired, sep='_'):
     out_pos_file = bam_file + '.tsv'
 
     # 2304 = get rid of 256 (secondary) + 2048 (supplementary)        
+    # samtools view leaves out the header unless asked for it
     cmd = [['samtools', 'view', os.path.basename(bam_file), '-F', '2304']]
-    cmd.append(['grep', '-v', '^@'])
     if paired:
-        # Now we use inline perl to parse the SAM flags and synthesize TSV
+        # Now we use awk to parse the SAM flags and synthesize TSV. Plain
+        # POSIX awk has no bitwise operators, so test the 64 and 128 flag
+        # bits arithmetically.
         # TODO: will need to switch to something more powerful to parse the score out of the AS tag. For now score everything as 0.
         # TODO: why _ and not / as the read name vs end number delimiter?
         # Note: we are now adding length/2 to the positions to be more consistent with vg annotate
-        cmd.append(['perl', '-ne', '@val = split("\t", $_); print @val[0] . "{}" . (@val[1] & 64 ? "1" : @val[1] & 128 ? "2" : "?"), "\t.\t" . @val[2] . "\t" . (@val[3] +  int(length(@val[9]) / 2)) . "\t0\t" . @val[4] . "\n";'.format(sep)])
+        cmd.append(['awk', '-F', '\t', '-v', 'OFS=\t', '-v', 'sep={}'.format(sep),
+                    '{ end = int($2 / 64) % 2 ? "1" : (int($2 / 128) % 2 ? "2" : "?"); '
+                    'print $1 sep end, ".", $3, $4 + int(length($10) / 2), 0, $5 }'])
     else:
         # No flags to parse since there's no end pairing and read names are correct.
-        # Use inline perl again and insert a fake 0 score column
+        # Use awk again and insert a fake 0 score column
         # Note: we are now adding length/2 to the positions to be more consistent with vg annotate        
-        cmd.append(['perl', '-ne', '@val = split("\t", $_); print @val[0] . "\t.\t" . @val[2] . "\t" . (@val[3] +  int(length(@val[9]) / 2)) . "\t0\t" . @val[4] . "\n";'])
+        cmd.append(['awk', '-F', '\t', '-v', 'OFS=\t',
+                    '{ print $1, ".", $3, $4 + int(length($10) / 2), 0, $5 }'])
     cmd.append(['sort'])
     
     with open(out_pos_file, 'wb') as out_pos:
@@ -739,6 +830,30 @@ def extract_bam_read_stats(job, context, name, bam_file_id, paired, sep='_'):
 
     stats_file_id = context.write_intermediate_file(job, out_pos_file)
     return stats_file_id
+    
+def extract_bam_read_stats_batch(job, context, bam_list, sep='_'):
+    """
+    Run extract_bam_read_stats on each of a list of (name, BAM file ID, paired
+    flag) tuples, one after another in this job, to save on job overhead for
+    small BAMs.
+    
+    Returns a list of read stats file IDs, in the same order.
+    
+    The job's disk is sized for one BAM, so each BAM and its stats TSV are
+    dropped from local disk once the stats have been uploaded.
+    """
+    
+    stats_file_ids = []
+    for name, bam_file_id, paired in bam_list:
+        stats_file_id = extract_bam_read_stats(job, context, name, bam_file_id, paired, sep=sep)
+        stats_file_ids.append(stats_file_id)
+        for file_id in [bam_file_id, stats_file_id]:
+            try:
+                job.fileStore.deleteLocalFile(file_id)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+    return stats_file_ids
 
     
 def annotate_gam(job, context, xg_file_id, gam_file_id):
@@ -794,18 +909,17 @@ def extract_gam_read_stats(job, context, name, gam_file_id, generate_tags=[]):
     
     RealtimeLogger.info("Extract GAM read stats from {}".format(name))
 
-    work_dir = job.fileStore.getLocalTempDir()
-
-    gam_file = os.path.join(work_dir, name)
-    job.fileStore.readGlobalFile(gam_file_id, gam_file)
+    # We only need the GAM until it is converted, so drop it after that
+    with staged_files(job, {name: gam_file_id}) as (work_dir, paths):
+        gam_file = paths[name]
 
-    out_pos_file = gam_file + '.tsv'
+        out_pos_file = gam_file + '.tsv'
                            
-    # go through intermediate json file until docker worked out
-    gam_annot_json = gam_file + '.json'
-    cmd = [['vg', 'view', '-aj', os.path.basename(gam_file)]]
-    with open(gam_annot_json, 'wb') as output_annot_json:
-        context.runner.call(job, cmd, work_dir = work_dir, outfile=output_annot_json)
+        # go through intermediate json file until docker worked out
+        gam_annot_json = gam_file + '.json'
+        cmd = [['vg', 'view', '-aj', os.path.basename(gam_file)]]
+        with open(gam_annot_json, 'wb') as output_annot_json:
+            context.runner.call(job, cmd, work_dir = work_dir, outfile=output_annot_json)
         
     # Write jq code to generate additional tags
     tag_generation = ''
@@ -814,9 +928,9 @@ def extract_gam_read_stats(job, context, name, gam_file_id, generate_tags=[]):
         tag_generation += ('.annotation.features = (if (.annotation.features | length) > 0 then .annotation.features else [] end + ' +
             'if .annotation.' + annotation_name + ' then ["' + annotation_name + '"] else [] end) | ')
 
-    # turn the annotated gam json into truth positions, as separate command since
-    # we're going to use a different docker container.  (Note, would be nice to
-    # avoid writing the json to disk)
+    # turn the annotated gam json into sorted truth positions, as separate
+    # command since we're going to use a different docker container.  (Note,
+    # would be nice to avoid writing the json to disk)
     # TODO: Deduplicate this code with the truth file generation code in vg_sim.py!
     jq_cmd = ['jq', '-c', '-r', tag_generation + '[.name] + '
               'if (.annotation.features | length) > 0 then [.annotation.features | join(",")] else ["."] end + '
@@ -826,22 +940,142 @@ def extract_gam_read_stats(job, context, name, gam_file_id, generate_tags=[]):
               os.path.basename(gam_annot_json)]
     # convert back to _1 format (only relevant if running on bam input reads where / added automatically)
     jq_pipe = [jq_cmd, ['sed', '-e', 's/null/0/g',  '-e', 's/\/1/_1/g', '-e', 's/\/2/_2/g']]
-    with open(out_pos_file + '.unsorted', 'wb') as out_pos:
+    # sort the read stats in the same pipeline. sort spills to its own
+    # temporary files when it runs low on memory, so there's no need to write
+    # out and re-read an unsorted copy.
+    jq_pipe.append(['sort'])
+    with open(out_pos_file, 'wb') as out_pos:
         context.runner.call(job, jq_pipe, work_dir = work_dir, outfile=out_pos)
 
     # get rid of that big json asap
     os.remove(gam_annot_json)
 
-    # sort the read stats file (not piping due to memory fears)
-    sort_cmd = ['sort', os.path.basename(out_pos_file) + '.unsorted']
-    with open(out_pos_file, 'wb') as out_pos:
-        context.runner.call(job, sort_cmd, work_dir = work_dir, outfile = out_pos)
-
     # Some lines may have refpos set while others do not (and those columns may be absent)
 
     out_stats_file_id = context.write_intermediate_file(job, out_pos_file)
     return out_stats_file_id
     
+def compare_position_records(truth, test, mapeval_threshold, out_stream):
+    """
+    Compare the read stats TSV lines in the file-like object test against the
+    true read stats in truth, and write a TSV line to out_stream for each read
+    present in both, as described in compare_positions.
+    
+    Both inputs must be in lexicographically sorted order by read name. They
+    are merged as streams, so memory use doesn't depend on the number of reads.
+    
+    Returns the number of true reads with no stats line, and the number of
+    stats lines for reads not in the truth.
+    """
+    
+    out = tsv.TsvWriter(out_stream)
+    
+    def list_or_none(l):
+        return l if l is None else list(l)
+    
+    # Make readers for the files
+    truth_reader = iter(tsv.TsvReader(truth))
+    test_reader = iter(tsv.TsvReader(test))
+    
+    # Start an iteration over them
+    true_fields = list_or_none(next(truth_reader, None))
+    test_fields = list_or_none(next(test_reader, None))
+    
+    # Track line numbers for error reporting
+    true_line = 1
+    test_line = 1
+    
+    # Count up the reads that only appear on one side
+    unaligned_count = 0
+    untrue_count = 0
+    
+    while true_fields is not None and test_fields is not None:
+        # We still have data on both sides
+        
+        # The minimum field count you can have for the truth is 6, because it must have at least one position.
+        # For the test data it can be 4, because the read may have no positions.
+        
+        if len(true_fields) < 6:
+            raise RuntimeError('Incorrect (<6) true field count on line {}: {}'.format(
+                true_line, true_fields))
+        
+        if len(test_fields) < 4:
+            raise RuntimeError('Incorrect (<4) test field count on line {}: {}'.format(
+                test_line, test_fields))
+        
+        true_read_name = true_fields[0]
+        aln_read_name = test_fields[0]
+        
+        if true_read_name < aln_read_name:
+            # This read wasn't aligned (or was downsampled away), so we need
+            # to advance the true read
+            unaligned_count += 1
+            true_fields = list_or_none(next(truth_reader, None))
+            true_line += 1
+            # Make sure we went forward
+            assert(true_fields == None or true_fields[0] > true_read_name)
+            continue
+        elif aln_read_name < true_read_name:
+            # This read isn't in the truth, so we need to advance the aligned
+            # read
+            untrue_count += 1
+            test_fields = list_or_none(next(test_reader, None))
+            test_line += 1
+            # Make sure we went forward
+            assert(test_fields == None or test_fields[0] > aln_read_name)
+            continue
+        
+        # The reads correspond. Check if the positions are right.
+        
+        # Grab the comma-separated tags from the truth file.
+        aln_tags = true_fields[1]
+        if aln_tags == '':
+            aln_tags = '.'
+        
+        # The test file also has a tag slot for additional tags
+        aln_extra_tags = test_fields[1]
+        if aln_extra_tags == '':
+            aln_extra_tags = '.'
+            
+        # Combine the tags into a set of all observed tags
+        combined_tags = set(aln_tags.split(',')) | set(aln_extra_tags.split(','))
+        # Except the no-tags '.' if present
+        combined_tags -= {'.'}
+        
+        # Make into a string again
+        combined_tags_string = ','.join(sorted(combined_tags)) if len(combined_tags) > 0 else '.'
+        
+        # map seq name->position
+        # Grab everything after the tags column and before the score and mapq columns, in pairs.
+        true_pos_dict = dict(zip(true_fields[2:-2:2], map(parse_int, true_fields[3:-2:2])))
+        
+        # Make sure the true reads came from somewhere
+        assert(len(true_pos_dict) > 0)
+        
+        # Skip over score field and get the MAPQ, which is last
+        aln_mapq = parse_int(test_fields[-1])
+        # The read is correct if any of its aligned positions is close
+        # enough to a true position on the same contig. any() stops at
+        # the first hit without building any intermediate lists.
+        aln_correct = int(any(aln_chr in true_pos_dict and abs(true_pos_dict[aln_chr] - aln_pos) < mapeval_threshold
+                              for aln_chr, aln_pos in zip(test_fields[2:-2:2], map(parse_int, test_fields[3:-2:2]))))
+
+        out.line(aln_read_name, aln_correct, aln_mapq, combined_tags_string)
+
+        # Advance both reads
+        true_fields = list_or_none(next(truth_reader, None))
+        true_line += 1
+        test_fields = list_or_none(next(test_reader, None))
+        test_line += 1
+    
+    # Whatever is left on either side has no partner
+    if true_fields is not None:
+        unaligned_count += 1 + sum(1 for _ in truth_reader)
+    if test_fields is not None:
+        untrue_count += 1 + sum(1 for _ in test_reader)
+    
+    return unaligned_count, untrue_count
+
 def compare_positions(job, context, truth_file_id, name, stats_file_id, mapeval_threshold):
     """
     Compares positions from two TSV files. Both files have the format:
@@ -870,108 +1104,22 @@ def compare_positions(job, context, truth_file_id, name, stats_file_id, mapeval_
     
     work_dir = job.fileStore.getLocalTempDir()
 
+    # Every condition is compared against the same truth, and we only read
+    # it, so share one cached copy between all the comparisons on this node.
     true_read_stats_file = os.path.join(work_dir, 'true.tsv')
-    job.fileStore.readGlobalFile(truth_file_id, true_read_stats_file)
+    job.fileStore.readGlobalFile(truth_file_id, true_read_stats_file, cache=True, symlink=True)
     test_read_stats_file = os.path.join(work_dir, name + '.tsv')
     job.fileStore.readGlobalFile(stats_file_id, test_read_stats_file)
 
     out_file = os.path.join(work_dir, name + '.compare.positions')
 
-    def list_or_none(l):
-        return l if l is None else list(l)
-    
     with open(true_read_stats_file) as truth, open(test_read_stats_file) as test, open(out_file, 'w') as out_stream:
-        out = tsv.TsvWriter(out_stream)
-        
-        # Make readers for the files
-        truth_reader = iter(tsv.TsvReader(truth))
-        test_reader = iter(tsv.TsvReader(test))
-        
-        # Start an iteration over them
-        true_fields = list_or_none(next(truth_reader, None))
-        test_fields = list_or_none(next(test_reader, None))
-        
-        # Track line numbers for error reporting
-        true_line = 1
-        test_line = 1
-        
-        while true_fields is not None and test_fields is not None:
-            # We still have data on both sides
-            
-            # The minimum field count you can have for the truth is 6, because it must have at least one position.
-            # For the test data it can be 4, because the read may have no positions.
-            
-            if len(true_fields) < 6:
-                raise RuntimeError('Incorrect (<6) true field count on line {}: {}'.format(
-                    true_line, true_fields))
-            
-            if len(test_fields) < 4:
-                raise RuntimeError('Incorrect (<4) test field count on line {}: {}'.format(
-                    test_line, test_fields))
-            
-            true_read_name = true_fields[0]
-            aln_read_name = test_fields[0]
-            
-            if true_read_name < aln_read_name:
-                # We need to advance the true read
-                true_fields = list_or_none(next(truth_reader, None))
-                true_line += 1
-                # Make sure we went forward
-                assert(true_fields == None or true_fields[0] > true_read_name)
-                continue
-            elif aln_read_name < true_read_name:
-                # We need to advance the aligned read
-                test_fields = list_or_none(next(test_reader, None))
-                test_line += 1
-                # Make sure we went forward
-                assert(test_fields == None or test_fields[0] > aln_read_name)
-                continue
-            else:
-                # The reads correspond. Check if the positions are right.
-                
-                assert(aln_read_name == true_read_name)
-
-                # Grab the comma-separated tags from the truth file.
-                aln_tags = true_fields[1]
-                if aln_tags == '':
-                    aln_tags = '.'
-                
-                # The test file also has a tag slot for additional tags
-                aln_extra_tags = test_fields[1]
-                if aln_extra_tags == '':
-                    aln_extra_tags = '.'
-                    
-                # Combine the tags into a set of all observed tags
-                combined_tags = set(aln_tags.split(',')) | set(aln_extra_tags.split(','))
-                # Except the no-tags '.' if present
-                combined_tags -= {'.'}
-                
-                # Make into a string again
-                combined_tags_string = ','.join(sorted(combined_tags)) if len(combined_tags) > 0 else '.'
-                
-                # map seq name->position
-                # Grab everything after the tags column and before the score and mapq columns, in pairs.
-                true_pos_dict = dict(list(zip(true_fields[2:-2:2], list(map(parse_int, true_fields[3:-2:2])))))
-                aln_pos_dict = dict(list(zip(test_fields[2:-2:2], list(map(parse_int, test_fields[3:-2:2])))))
-                
-                # Make sure the true reads came from somewhere
-                assert(len(true_pos_dict) > 0)
-                
-                # Skip over score field and get the MAPQ, which is last
-                aln_mapq = parse_int(test_fields[-1])
-                aln_correct = 0
-                for aln_chr, aln_pos in list(aln_pos_dict.items()):
-                    if aln_chr in true_pos_dict and abs(true_pos_dict[aln_chr] - aln_pos) < mapeval_threshold:
-                        aln_correct = 1
-                        break
-
-                out.line(aln_read_name, aln_correct, aln_mapq, combined_tags_string)
-        
-                # Advance both reads
-                true_fields = list_or_none(next(truth_reader, None))
-                true_line += 1
-                test_fields = list_or_none(next(test_reader, None))
-                test_line += 1
+        unaligned_count, untrue_count = compare_position_records(truth, test, mapeval_threshold, out_stream)
+    
+    if unaligned_count > 0:
+        RealtimeLogger.warning('{} true reads have no stats for {}'.format(unaligned_count, name))
+    if untrue_count > 0:
+        RealtimeLogger.warning('{} reads for {} are not in the truth'.format(untrue_count, name))
         
     out_file_id = context.write_output_file(job, out_file)
     return out_file_id
@@ -999,8 +1147,10 @@ def compare_scores(job, context, baseline_name, baseline_file_id, name, score_fi
     
     work_dir = job.fileStore.getLocalTempDir()
 
+    # Every condition is compared against the same baseline, and we only read
+    # it, so share one cached copy between all the comparisons on this node.
     baseline_read_stats_file = os.path.join(work_dir, 'baseline.tsv')
-    job.fileStore.readGlobalFile(baseline_file_id, baseline_read_stats_file)
+    job.fileStore.readGlobalFile(baseline_file_id, baseline_read_stats_file, cache=True, symlink=True)
     test_read_stats_file = os.path.join(work_dir, name + '.tsv')
     job.fileStore.readGlobalFile(score_file_id, test_read_stats_file)
 
@@ -1065,8 +1215,9 @@ def compare_scores(job, context, baseline_name, baseline_file_id, name, score_fi
                 test_fields = list_or_none(next(test_reader, None))
                 test_line += 1
                 
-    # Save stats file for inspection
-    out_file_id = context.write_intermediate_file(job, out_file)
+    # Save stats file for inspection. It goes to the out store here, so nobody
+    # needs to download it again just to export it.
+    out_file_id = context.write_output_file(job, out_file)
         
     return out_file_id
 
@@ -1127,7 +1278,7 @@ def run_map_eval_index(job, context, xg_file_ids, gcsa_file_ids, gbwt_file_ids,
 def run_map_eval_align(job, context, index_ids, xg_comparison_ids, gam_names, gam_file_ids,
                        reads_fastq_single_ids, reads_fastq_paired_ids, reads_fastq_paired_for_vg_ids,
                        fasta_file_id, matrix, bwa_index_ids=[], minimap2_index_id=None, ignore_quals=False,
-                       surject=False, validate=False):
+                       surject=False, validate=False, save_bwa_index=False):
     """
     
     Run alignments, if alignment files have not already been provided.
@@ -1167,6 +1318,9 @@ def run_map_eval_align(job, context, index_ids, xg_comparison_ids, gam_names, ga
     If gam_file_ids are specified, passes those through instead of doing any vg
     mapping, but still does bwa mapping if requested.
     
+    If save_bwa_index is set and a BWA index has to be built, it is saved to
+    the out store along with its FASTA, for use in later runs.
+    
     """
 
     # The input GAM names must be unique
@@ -1516,7 +1670,8 @@ def run_map_eval_align(job, context, index_ids, xg_comparison_ids, gam_names, ga
                 bwa_index_job = bwa_start_job.addChildJobFn(run_bwa_index, context,
                                                             fasta_file_id,
                                                             bwa_index_ids=bwa_index_ids,
-                                                            intermediate=True,
+                                                            intermediate=not save_bwa_index,
+                                                            copy_fasta=save_bwa_index,
                                                             cores=context.config.bwa_index_cores, memory=context.config.bwa_index_mem,
                                                             disk=context.config.bwa_index_disk)
                 bwa_index_ids = bwa_index_job.rv()
@@ -1591,7 +1746,7 @@ def run_map_eval_align(job, context, index_ids, xg_comparison_ids, gam_names, ga
     
 def run_map_eval_comparison(job, context, mapping_condition_dict, true_read_stats_file_id,
                             mapeval_threshold, score_baseline_name=None, original_read_gam=None,
-                            downsample_portion=None, gbwt_usage_tag_gam_name=None):
+                            downsample_portion=None, gbwt_usage_tag_gam_name=None, stats_batch_size=1):
     """
     run the mapping comparison.  Dump some tables into the outstore.
     
@@ -1623,6 +1778,9 @@ def run_map_eval_comparison(job, context, mapping_condition_dict, true_read_stat
     annotations will be generated for the GAM with that name, and propagated to
     all the other conditions nin the combined stats file.
     
+    BAMs that don't need downsampling have their stats extracted in batches of
+    up to stats_batch_size BAMs per job.
+    
     """
    
     RealtimeLogger.info("Comparing mapping results")
@@ -1633,6 +1791,25 @@ def run_map_eval_comparison(job, context, mapping_condition_dict, true_read_stat
     # We need to keep the GAM and BAM stats jobs around to wait on them
     stats_jobs = []
     
+    # BAMs we can batch up are held here as (condition, filename, BAM ID,
+    # paired flag) until we have enough for a job.
+    bam_batch = []
+    
+    def flush_bam_batch():
+        """
+        Make a job to extract stats from all the BAMs in the batch, and commit
+        the stats back to their conditions.
+        """
+        if len(bam_batch) == 0:
+            return
+        stats_jobs.append(job.addChildJobFn(extract_bam_read_stats_batch, context,
+                                            [(bam_filename, bam_id, paired) for _, bam_filename, bam_id, paired in bam_batch],
+                                            cores=context.config.misc_cores, memory=context.config.misc_mem,
+                                            disk=context.config.alignment_disk))
+        for i, (condition, _, _, _) in enumerate(bam_batch):
+            condition['stats'] = stats_jobs[-1].rv(i)
+        del bam_batch[:]
+    
     for condition_number, (name, condition) in enumerate(mapping_condition_dict.items()):
         if 'bam' in condition:
             # Compute bam stats
@@ -1651,6 +1828,14 @@ def run_map_eval_comparison(job, context, mapping_condition_dict, true_read_stat
                 bam_id = parent_job.rv()
         
             bam_filename = '{}-{}.bam'.format(name, condition_number)
+            
+            if parent_job is job and stats_batch_size > 1:
+                # Nothing to wait for, so the stats can come from a shared job
+                bam_batch.append((condition, bam_filename, bam_id, condition['paired']))
+                if len(bam_batch) >= stats_batch_size:
+                    flush_bam_batch()
+                continue
+            
             stats_jobs.append(parent_job.addChildJobFn(extract_bam_read_stats, context, bam_filename, bam_id, condition['paired'],
                                                            cores=context.config.misc_cores, memory=context.config.misc_mem,
                                                            disk=context.config.alignment_disk))
@@ -1702,6 +1887,9 @@ def run_map_eval_comparison(job, context, mapping_condition_dict, true_read_stat
             # Commit the stats back to the condition dict
             condition['stats'] = stats_jobs[-1].rv()
             
+    # Extract stats from any leftover BAMs
+    flush_bam_batch()
+            
     # compare all our positions, and dump results to the out store. Get a tuple
     # of individual comparison files and overall stats file.
     position_comparison_job = job.addChildJobFn(run_map_eval_compare_positions, context,
@@ -1984,14 +2172,8 @@ def run_process_position_comparisons(job, context, compare_ids):
     
         # Compute position stats from the per-read files
         # TODO: Modify these to use the summary files
-        map_stats[name] = [job.addChildJobFn(run_acc, context, name, compare_id, cores=context.config.misc_cores,
-                                             memory=context.config.misc_mem, disk=context.config.misc_disk).rv(),
-                           job.addChildJobFn(run_auc, context, name, compare_id, cores=context.config.misc_cores,
-                                             memory=context.config.misc_mem, disk=context.config.misc_disk).rv(),
-                           job.addChildJobFn(run_qq, context, name, compare_id, cores=context.config.misc_cores,
-                                             memory=context.config.misc_mem, disk=context.config.misc_disk).rv(),
-                           job.addChildJobFn(run_max_f1, context, name, compare_id, cores=context.config.misc_cores,
-                                             memory=context.config.misc_mem, disk=context.config.misc_disk).rv()]
+        map_stats[name] = job.addChildJobFn(run_position_stats, context, name, compare_id, cores=context.config.misc_cores,
+                                            memory=context.config.misc_mem, disk=context.config.misc_disk).rv()
             
     # Return the position stats file, built from all the individual stat calculations, and the concatenated position.results.tsv.
     return (job.addFollowOnJobFn(run_write_position_stats, context, map_stats).rv(),
@@ -2032,27 +2214,33 @@ def run_summarize_position_comparison(job, context, compare_id, aligner_name):
         writer = tsv.TsvWriter(out_stream)
 
         compare_file_path = os.path.join(work_dir, 'compare-file')
-        job.fileStore.readGlobalFile(compare_id, compare_file_path)
+        # We only read this, so a link to a cached copy will do
+        job.fileStore.readGlobalFile(compare_id, compare_file_path, cache=True, symlink=True)
         with open(compare_file_path, 'r') as in_stream:
-            # Read it from the input per-read file
-            reader = tsv.TsvReader(in_stream)
+            # Read it from the input per-read file. We wrote it ourselves with
+            # no comments, so we can split the lines directly.
             
             # This will hold counts for (correct, mq, tags, method) tuples.
             # Tags are represented as a string.
             # We only summarize correct reads.
             summary_counts = Counter()
             # Wrong reads are just dumped as they occur with count 1
-            for toks in reader:
+            for line in in_stream:
+                toks = line.rstrip('\n').split('\t')
+                if len(toks) < 3:
+                    # Blank line
+                    continue
                 # Label the read fields so we can see what we're doing
-                # Note that empty 'tags' columns may not be read by the TSV reader.
-                read = dict(list(zip(['name', 'correct', 'mapq', 'tags'], list(toks))))
+                read_name, read_correct, read_mapq = toks[0], toks[1], toks[2]
+                # Note that the 'tags' column may be empty or missing.
+                read_tags = toks[3] if len(toks) > 3 and toks[3] != '' else '.'
                 
-                if read['correct'] == '1':
+                if read_correct == '1':
                     # Correct, so summarize
-                    summary_counts[(read['correct'], read['mapq'], read.get('tags', '.'), aligner_name)] += 1
+                    summary_counts[(read_correct, read_mapq, read_tags, aligner_name)] += 1
                 else:
                     # Incorrect, write the whole line
-                    writer.line(read['correct'], read['mapq'], read.get('tags', '.'), aligner_name, read['name'], 1)
+                    writer.line(read_correct, read_mapq, read_tags, aligner_name, read_name, 1)
             for parts, count in list(summary_counts.items()):
                 # Write summary lines with empty read names
                 # Omitting the read name entirely upsets R, so we will use a dot as in VCF for missing data.
@@ -2086,33 +2274,56 @@ def run_write_position_stats(job, context, map_stats):
     
     return stats_file_id
     
-def run_acc(job, context, name, compare_id):
+def run_position_stats(job, context, name, compare_id):
     """
-    Percentage of correctly aligned reads (ignore quality)
+    Compute the accuracy, AUC, QQ, and max F1 statistics for a position
+    comparison file, downloading and parsing it only once.
 
-    Comparison file input must be TSV with one row per read, column 0 unused
-    and column 1 as the correct flag.
+    Comparison file input must be TSV with one row per read, column 0 unused,
+    column 1 as the correct flag, and column 2 as the MAPQ.
+    
+    Returns a list of the accuracy, AUC, QQ, and max F1 results, in the order
+    run_write_position_stats expects.
     """
     
-    RealtimeLogger.info("Computing accuracy")
+    RealtimeLogger.info("Computing position statistics for {}".format(name))
     
     work_dir = job.fileStore.getLocalTempDir()
 
     compare_file = os.path.join(work_dir, '{}.compare.positions'.format(name))
-    job.fileStore.readGlobalFile(compare_id, compare_file)
-    
-    total = 0
-    correct = 0
+    # We only read this, so a link to a cached copy will do
+    job.fileStore.readGlobalFile(compare_id, compare_file, cache=True, symlink=True)
+    
+    # Pull out the correct flags and the MAPQs. We wrote this file ourselves
+    # with no comments, so we can split the lines directly and skip the
+    # per-field stripping TsvReader does.
+    correct = []
+    mapq = []
     with open(compare_file) as compare_f:
-        for toks in tsv.TsvReader(compare_f):
-            total += 1
-            if list(toks)[1] == '1':
-                correct += 1
-                
-    acc = float(correct) / float(total) if total > 0 else 0
+        for line in compare_f:
+            toks = line.split('\t', 3)
+            if len(toks) < 3:
+                # Blank line
+                continue
+            correct.append(int(toks[1]))
+            mapq.append(int(toks[2]))
+            
+    return [position_acc(correct), position_auc(correct, mapq),
+            position_qq(correct, mapq), position_max_f1(correct, mapq)]
+    
+def position_acc(correct):
+    """
+    Percentage of correctly aligned reads (ignore quality)
+
+    Takes a list of correct flags, one per read. Returns the total read count
+    and the accuracy.
+    """
+    
+    total = len(correct)
+    acc = float(sum(correct)) / float(total) if total > 0 else 0
     return total, acc
     
-def run_auc(job, context, name, compare_id):
+def position_auc(correct, mapq):
     """
     AUC of roc plot.
     
@@ -2121,32 +2332,24 @@ def run_auc(job, context, name, compare_id):
     correctly-mapped-ness the MAPQ score is. It says nothing about how well the
     reads are actually mapped.
 
-    Comparison file input must be TSV with one row per read, column 0 unused,
-    column 1 as the correct flag, and column 2 as the MAPQ.
+    Takes parallel lists of correct flags and MAPQs. Returns the AUC and the
+    average precision.
     
     """
     
-    RealtimeLogger.info("Computing AUC")
-    
     if not have_sklearn:
         return ["sklearn_not_installed"] * 2 
     
-    work_dir = job.fileStore.getLocalTempDir()
-
-    compare_file = os.path.join(work_dir, '{}.compare.positions'.format(name))
-    job.fileStore.readGlobalFile(compare_id, compare_file)
-
     try:
-        data = np.loadtxt(compare_file, dtype=np.int, delimiter ='\t', usecols=(1,2)).T
-        auc = roc_auc_score(data[0], data[1])
-        aupr = average_precision_score(data[0], data[1])
+        auc = roc_auc_score(correct, mapq)
+        aupr = average_precision_score(correct, mapq)
     except:
-        # will happen if file is empty
+        # will happen if there are no reads, or they are all one class
         auc, aupr = 0, 0
 
     return auc, aupr
     
-def run_max_f1(job, context, name, compare_id):
+def position_max_f1(correct, mapq):
     """
     Compute and return maximum F1 score for correctly mapping reads, using MAPQ as a confidence.
     
@@ -2162,28 +2365,16 @@ def run_max_f1(job, context, name, compare_id):
     Then we calculate precision = TP / (TP + FP) and recall = TP / (TP + FN), and from those calculate an F1.
     Then we calculate the best F1 across all the MAPQ values.
 
-    Comparison file input must be TSV with one row per read, column 0 unused,
-    column 1 as the correct flag, and column 2 as the MAPQ.
+    Takes parallel lists of correct flags and MAPQs.
     
     """
     
-    RealtimeLogger.info("Computing max F1")
-    
     if not have_sklearn:
         return "sklearn_not_installed" 
     
-    work_dir = job.fileStore.getLocalTempDir()
-
-    compare_file = os.path.join(work_dir, '{}.compare.positions'.format(name))
-    job.fileStore.readGlobalFile(compare_id, compare_file)
-
-    # Load up the correct/incorrect flag (data[_, 1]) and the scores (data[_, 2])
-    data = np.loadtxt(compare_file, dtype=np.int, delimiter ='\t', usecols=(1,2))
-    
-    # Sort on score (see <https://stackoverflow.com/a/2828121/402891>) in
-    # descending order. So reads we want to take first come first.
-    RealtimeLogger.info("DEBUG: data: {}".format(data))
-    data = data[data[:,1].argsort()[::-1]]
+    # Sort on score in descending order. So reads we want to take first come
+    # first.
+    data = sorted(zip(correct, mapq), key=lambda read: read[1], reverse=True)
     
     # What's the last MAPQ we did?
     last_mapq = None
@@ -2209,7 +2400,7 @@ def run_max_f1(job, context, name, compare_id):
                 return max(max_f1, f1)
         return max_f1
     
-    for correct, score in data:
+    for read_correct, score in data:
         # For each read in descending MAPQ order
         
         if score != last_mapq:
@@ -2217,7 +2408,7 @@ def run_max_f1(job, context, name, compare_id):
             max_f1 = emit_f1()
             
         # This read is now a positive. It may be true or false.
-        if correct:
+        if read_correct:
             tp += 1
         else:
             fp += 1
@@ -2229,46 +2420,35 @@ def run_max_f1(job, context, name, compare_id):
         
     return max_f1
 
-def run_qq(job, context, name, compare_id):
+def position_qq(correct, mapq):
     """
     some measure of qq consistency
 
-    Comparison file input must be TSV with one row per read, column 0 unused,
-    column 1 as the correct flag, and column 2 as the MAPQ.
+    Takes parallel lists of correct flags and MAPQs.
     """
     
-    RealtimeLogger.info("Computing QQ information")
-    
     if not have_sklearn:
         return "sklearn_not_installed"
 
-    work_dir = job.fileStore.getLocalTempDir()
-
-    compare_file = os.path.join(work_dir, '{}.compare.positions'.format(name))
-    job.fileStore.readGlobalFile(compare_id, compare_file)
-
     try:
-        data = np.loadtxt(compare_file, dtype=np.int, delimiter ='\t', usecols=(1,2))
-
-        # this can surley be sped up if necessary
-        correct = Counter()
-        total = Counter()
-        for row in data:
-            correct[row[1]] += row[0]
-            total[row[1]] += 1
+        correct_by_qual = Counter()
+        total_by_qual = Counter()
+        for read_correct, qual in zip(correct, mapq):
+            correct_by_qual[qual] += read_correct
+            total_by_qual[qual] += 1
 
         qual_scores = []
         qual_observed = []            
-        for qual, cor in list(correct.items()):
+        for qual, cor in list(correct_by_qual.items()):
             qual_scores.append(qual)
-            p_err = max(1. - float(cor) / float(total[qual]), sys.float_info.epsilon)
+            p_err = max(1. - float(cor) / float(total_by_qual[qual]), sys.float_info.epsilon)
             observed_score =-10. * math.log10(p_err)
             qual_observed.append(observed_score)
 
         # should do non-linear regression as well? 
         r2 = r2_score(qual_observed, qual_scores)
     except:
-        # will happen if file is empty
+        # will happen if there are no reads
         r2 = 'fail'
 
     return r2
@@ -2343,25 +2523,32 @@ def run_process_score_comparisons(job, context, baseline_name, compare_ids):
         out_results = tsv.TsvWriter(out_results_file)
         out_results.comment('diff\taligner')
 
-        def write_tsv(comp_file, a):
+        def write_tsv(compare_id, a):
             """
-            Read the given comparison TSV for the given condition name, and dump
-            it to the combined results file.
+            Stream the comparison file with the given ID for the given
+            condition name, and dump it to the combined results file.
             """
-            with open(comp_file) as comp_in:
+            # Every line ends with the same condition name column
+            line_end = '\t{}\n'.format(a)
+            
+            def result_lines(comp_in):
                 for line in comp_in:
-                    content = line.rstrip()
+                    content = line.decode('utf-8').rstrip()
                     if content != '':
-                        toks = content.split(', ')
+                        toks = content.split(', ', 2)
                         if len(toks) < 2:
                             raise RuntimeError('Invalid comparison file line ' + content)
-                        out_results.line(toks[1], a)
+                        yield toks[1] + line_end
+            
+            with job.fileStore.readGlobalFileStream(compare_id) as comp_in:
+                # Hand whole lines to the file instead of writing each field
+                # separately through the TsvWriter.
+                out_results_file.writelines(result_lines(comp_in))
 
         for name, compare_id in list(compare_ids.items()):
-            compare_file = os.path.join(work_dir, '{}.compare.{}.scores'.format(name, baseline_name))
-            job.fileStore.readGlobalFile(compare_id, compare_file)
-            context.write_output_file(job, compare_file)
-            write_tsv(compare_file, name)
+            # compare_scores already exported the comparison file, so we only
+            # need to read it through once.
+            write_tsv(compare_id, name)
 
             # Tabulate overall statistics
             map_stats[name] = [job.addChildJobFn(run_portion_worse, context, name, compare_id,
@@ -2406,7 +2593,8 @@ def run_portion_worse(job, context, name, compare_id):
     work_dir = job.fileStore.getLocalTempDir()
 
     compare_file = os.path.join(work_dir, '{}.compare.scores'.format(name))
-    job.fileStore.readGlobalFile(compare_id, compare_file)
+    # We only read this, so a link to a cached copy will do
+    job.fileStore.readGlobalFile(compare_id, compare_file, cache=True, symlink=True)
     
     total = 0
     worse = 0
@@ -2569,7 +2757,7 @@ def run_mapeval(job, context, options, xg_file_ids, xg_comparison_ids, gcsa_file
                                                bwa_index_ids=bwa_index_ids,
                                                minimap2_index_id=minimap2_index_id,
                                                ignore_quals=options.ignore_quals, surject=options.surject,
-                                               validate=options.validate)
+                                               validate=options.validate, save_bwa_index=options.save_bwa_index)
                                                
     # Grab the results dict organized by generated condition name, each
     # containing "gam", "bam", "xg", "runtime", "paired" keys as appropriate.
@@ -2591,6 +2779,7 @@ def run_mapeval(job, context, options, xg_file_ids, xg_comparison_ids, gcsa_file
                      true_read_stats_file_id, options.mapeval_threshold, options.compare_gam_scores, reads_gam_file_id,
                      downsample_portion=options.downsample,
                      gbwt_usage_tag_gam_name=options.gbwt_baseline,
+                     stats_batch_size=options.stats_batch_size,
                      cores=context.config.misc_cores, memory=context.config.misc_mem,
                      disk=context.config.misc_disk)
 
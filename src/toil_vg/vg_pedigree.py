@@ -1,21 +1,11 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """
 vg_pedigree.py: pedigree map and calling pipeline to produce parental-enhanced mapping and calling output.
 
 """
-import argparse, sys, os, os.path, errno, random, subprocess, shutil, itertools, glob, tarfile
-import doctest, re, json, collections, time, timeit
-import logging, logging.handlers, struct, socket, threading
-import string
-import getpass
-import gzip
-import pipes
-import shlex
-
-from math import ceil
-from subprocess import Popen, PIPE
-
-from toil.common import Toil
+import sys, os, os.path, re, time, timeit
+import logging
+
 from toil.job import Job
 from toil.realtimeLogger import RealtimeLogger
 
@@ -31,6 +21,20 @@ from toil_vg.pedigree_analysis import *
 
 logger = logging.getLogger(__name__)
 
+# Index types read by each vg mapper during pedigree alignment
+mapper_index_types = {
+    'map': {'xg', 'gcsa', 'lcp', 'gbwt', 'id_ranges'},
+    'mpmap': {'xg', 'gcsa', 'lcp', 'gbwt', 'snarls', 'id_ranges'},
+    'giraffe': {'xg', 'gbwt', 'minimizer', 'distance', 'id_ranges'}
+}
+
+# Index options that must be given for each vg mapper
+mapper_required_index_options = {
+    'map': ['xg_index', 'gcsa_index'],
+    'mpmap': ['xg_index', 'gcsa_index'],
+    'giraffe': ['xg_index', 'minimizer_index', 'distance_index', 'gbwt_index']
+}
+
 def pedigree_subparser(parser):
     """
     Create a subparser for pedigree workflow.  Should pass in results of subparsers.add_parser()
@@ -81,35 +85,12 @@ def pedigree_subparser(parser):
                         help="basename of a udp data directory which is used to ferry input and output files to and from the dragen module (NIH Biowulf only).")
     parser.add_argument("--helix_username", type=str, default=None,
                         help="username that's used for accessing the Dragen module from NIH's Helix server (NIH Biowulf only)")
-    parser.add_argument("--fastq_proband", nargs='+', type=make_url,
-                        help="Proband input fastq(s) (possibly compressed), two are allowed, one for each mate")
-    parser.add_argument("--fastq_maternal", nargs='+', type=make_url,
-                        help="Maternal input fastq(s) (possibly compressed), two are allowed, one for each mate")
-    parser.add_argument("--fastq_paternal", nargs='+', type=make_url,
-                        help="Paternal input fastq(s) (possibly compressed), two are allowed, one for each mate")
-    parser.add_argument("--fastq_siblings", nargs='+', type=make_url, default=None,
-                        help="Sibling input fastq(s) (possibly compressed), two are allowed, one for each mate per sibling.\
-                            Sibling read-pairs must be input adjacent to eachother. Must follow same order as input to\
-                            --sibling_names argument.")
-    parser.add_argument("--gam_input_reads_proband", type=make_url, default=None,
-                        help="Input reads of proband in GAM format")
-    parser.add_argument("--gam_input_reads_maternal", type=make_url, default=None,
-                        help="Input reads of mother in GAM format")
-    parser.add_argument("--gam_input_reads_paternal", type=make_url, default=None,
-                        help="Input reads of father in GAM format")
-    parser.add_argument("--gam_input_reads_siblings", nargs='+', type=make_url, default=None,
-                        help="Input reads of sibling(s) in GAM format. Must follow same order as input to\
-                            --sibling_names argument.")
-    parser.add_argument("--bam_input_reads_proband", type=make_url, default=None,
-                        help="Input reads of proband in BAM format")
-    parser.add_argument("--bam_input_reads_maternal", type=make_url, default=None,
-                        help="Input reads of mother in BAM format")
-    parser.add_argument("--bam_input_reads_paternal", type=make_url, default=None,
-                        help="Input reads of father in BAM format")
-    parser.add_argument("--bam_input_reads_siblings", nargs='+', type=make_url, default=None,
-                        help="Input reads of sibling(s) in BAM format. Must follow same order as input to\
-                            --sibling_names argument.")
-    
+    # Read inputs for each member of the pedigree
+    for member, fastq_desc, reads_desc in [('proband', 'Proband', 'proband'),
+                                           ('maternal', 'Maternal', 'mother'),
+                                           ('paternal', 'Paternal', 'father')]:
+        add_member_read_args(parser, member, fastq_desc, reads_desc)
+    add_member_read_args(parser, 'siblings', 'Sibling', 'sibling(s)', siblings=True)
 
     # Add common indexing options shared with vg_index
     index_parse_args(parser)
@@ -129,6 +110,26 @@ def pedigree_subparser(parser):
     # Add common analysis options
     pedigree_analysis_parse_args(parser)
 
+def add_member_read_args(parser, member, fastq_desc, reads_desc, siblings=False):
+    """
+    Add the --fastq_*, --gam_input_reads_* and --bam_input_reads_* options for
+    one member of the pedigree. The siblings options take one file (or fastq
+    pair) per sibling, in the same order as --sibling_names.
+    """
+    order_note = ''
+    if siblings:
+        order_note = ' Must follow same order as input to --sibling_names argument.'
+        parser.add_argument("--fastq_siblings", nargs='+', type=make_url, default=None,
+                            help="Sibling input fastq(s) (possibly compressed), two are allowed, one for each mate per sibling."
+                            " Sibling read-pairs must be input adjacent to eachother." + order_note)
+    else:
+        parser.add_argument("--fastq_{}".format(member), nargs='+', type=make_url,
+                            help="{} input fastq(s) (possibly compressed), two are allowed, one for each mate".format(fastq_desc))
+    for fmt in ['GAM', 'BAM']:
+        parser.add_argument("--{}_input_reads_{}".format(fmt.lower(), member), nargs='+' if siblings else None,
+                            type=make_url, default=None,
+                            help="Input reads of {} in {} format.{}".format(reads_desc, fmt, order_note))
+
 def pedigree_parse_args(parser, stand_alone = False):
     """
     Define pedigree arguments shared with map
@@ -191,18 +192,19 @@ def validate_pedigree_options(context, options):
     """
     Throw an error if an invalid combination of options has been selected.
     """
-    require(options.xg_index is not None, 'All mappers require --xg_index')
-    
-    if options.mapper == 'map' or options.mapper == 'mpmap':
-        require(options.gcsa_index, '--gcsa_index is required for map and mpmap')
+    # --mapper is restricted by argparse choices, so it is in the table here.
+    for index_option in mapper_required_index_options[options.mapper]:
+        require(getattr(options, index_option), '--{} is required for {}'.format(index_option, options.mapper))
     
-    if options.mapper == 'gaffe':
-        require(options.minimizer_index, '--minimizer_index is required for gaffe')
-        require(options.distance_index, '--distance_index is required for gaffe')
-        require(options.gbwt_index, '--gbwt_index is required for gaffe')
-        require(not options.bam_input_reads, '--bam_input_reads is not supported with gaffe')
-        require(not options.interleaved, '--interleaved is not supported with gaffe')
-        require(options.fastq is None or len(options.fastq) < 2, 'Multiple --fastq files are not supported with gaffe')
+    if options.mapper == 'giraffe':
+        require(not (options.bam_input_reads_proband or options.bam_input_reads_maternal or
+                     options.bam_input_reads_paternal or options.bam_input_reads_siblings),
+                '--bam_input_reads_* is not supported with giraffe')
+        require(not options.interleaved, '--interleaved is not supported with giraffe')
+        require(all(fastq is None or len(fastq) < 2 for fastq in
+                    [options.fastq_proband, options.fastq_maternal, options.fastq_paternal]) and
+                (options.fastq_siblings is None or len(options.fastq_siblings) == len(options.sibling_names)),
+                'Multiple --fastq_* files per sample are not supported with giraffe')
     
     
     require(options.fastq_proband is None or len(options.fastq_proband) in [1, 2], 'Exacty 1 or 2'\
@@ -216,16 +218,16 @@ def validate_pedigree_options(context, options):
             or (options.fastq_proband is None and options.fastq_maternal is None and options.fastq_paternal is None and options.fastq_siblings is None)
             or (len(options.fastq_proband) == 1 and len(options.fastq_maternal) == 1 and len(options.fastq_paternal) == 1 and len(options.fastq_siblings) == len(options.sibling_names)),
             '--interleaved cannot be used when > 1 fastq given for any individual in the pedigree')
-    require(sum(map(lambda x : 1 if x else 0, [options.fastq_proband, options.gam_input_reads_proband, options.bam_input_reads_proband])) == 1,
+    require(bool(options.fastq_proband) + bool(options.gam_input_reads_proband) + bool(options.bam_input_reads_proband) == 1,
             'reads must be speficied with either --fastq_proband or --gam_input_reads_proband or --bam_input_reads_proband')
-    require(sum(map(lambda x : 1 if x else 0, [options.fastq_maternal, options.gam_input_reads_maternal, options.bam_input_reads_maternal])) == 1,
+    require(bool(options.fastq_maternal) + bool(options.gam_input_reads_maternal) + bool(options.bam_input_reads_maternal) == 1,
             'reads must be speficied with either --fastq_maternal or --gam_input_reads_maternal or --bam_input_reads_maternal')
-    require(sum(map(lambda x : 1 if x else 0, [options.fastq_paternal, options.gam_input_reads_paternal, options.bam_input_reads_paternal])) == 1,
+    require(bool(options.fastq_paternal) + bool(options.gam_input_reads_paternal) + bool(options.bam_input_reads_paternal) == 1,
             'reads must be speficied with either --fastq_paternal or --gam_input_reads_paternal or --bam_input_reads_paternal')
     require(options.mapper == 'mpmap' or options.snarls_index is None,
             '--snarls_index can only be used with --mapper mpmap') 
     if options.mapper == 'mpmap':
-        require(('-F' in context.config.mpmap_opts or '--output-fmt' in context.config.mpmap_opts) and 'GAM' in context.config.mpmap_opts,
+        require(mpmap_outputs_gam(context.config.mpmap_opts),
                 '-F GAM must be used with mpmap mapper to produce GAM output')
         require(not options.bam_output,
                 '--bam_output not currently supported with mpmap mapper')
@@ -1466,8 +1468,8 @@ def run_pedigree(job, context, options, fastq_proband, gam_input_reads_proband,
     are extra and specifying them will change mapping behavior. Some indexes
     are required for certain values of mapper.
     
-    mapper can be 'map', 'mpmap', or 'gaffe'. For 'map' and 'mpmap', the 'gcsa'
-    and 'lcp' indexes are required. For 'gaffe', the 'gbwt', 'minimizer' and
+    mapper can be 'map', 'mpmap', or 'giraffe'. For 'map' and 'mpmap', the 'gcsa'
+    and 'lcp' indexes are required. For 'giraffe', the 'gbwt', 'minimizer' and
     'distance' indexes are required. All the mappers require the 'xg' index.
     
     If bam_output is set, produce BAMs. If surject is set, surject reads down
@@ -1505,12 +1507,27 @@ def run_pedigree(job, context, options, fastq_proband, gam_input_reads_proband,
     stage3_jobs.addFollowOn(stage4_jobs)
     
     
+    # The proband is aligned twice, once to the input graph and once to the
+    # parental graph, so chunk its reads once up front and hand the same chunks
+    # to both alignments instead of splitting the input files again.
+    if reads_chunk_ids_proband is None:
+        proband_split_job = stage1_jobs.addChildJobFn(run_split_reads_if_needed, context, fastq_proband,
+                                         gam_input_reads_proband, bam_input_reads_proband,
+                                         reads_file_ids_proband,
+                                         cores=context.config.misc_cores,
+                                         memory=context.config.misc_mem,
+                                         disk=context.config.misc_disk)
+        reads_chunk_ids_proband = proband_split_job.rv()
+    else:
+        proband_split_job = Job()
+        stage1_jobs.addChild(proband_split_job)
+    
     # Define the probands 1st alignment and variant calling jobs
-    proband_first_mapping_job = stage1_jobs.addChildJobFn(run_mapping, context, fastq_proband,
+    proband_first_mapping_job = proband_split_job.addFollowOnJobFn(run_mapping, context, fastq_proband,
                                      gam_input_reads_proband, bam_input_reads_proband,
                                      proband_name,
                                      interleaved, mapper, indexes,
-                                     reads_file_ids_proband,
+                                     reads_chunk_ids=reads_chunk_ids_proband,
                                      bam_output=bam_output, surject=surject,
                                      cores=context.config.misc_cores,
                                      memory=context.config.misc_mem,
@@ -1603,7 +1620,7 @@ def run_pedigree(job, context, options, fastq_proband, gam_input_reads_proband,
                                      gam_input_reads_proband, bam_input_reads_proband,
                                      proband_name,
                                      interleaved, mapper, process_parental_graph_indexes_job.rv(),
-                                     reads_file_ids_proband,
+                                     reads_chunk_ids=reads_chunk_ids_proband,
                                      bam_output=options.bam_output, surject=options.surject,
                                      cores=context.config.misc_cores,
                                      memory=context.config.misc_mem,
@@ -1787,22 +1804,31 @@ def pedigree_main(context, options):
             # Make an index collection
             indexes = {}
            
-            # Upload each index we have
-            if options.xg_index is not None:
-                indexes['xg'] = importer.load(options.xg_index)
-            if options.gcsa_index is not None:
-                indexes['gcsa'] = importer.load(options.gcsa_index)
-                indexes['lcp'] = importer.load(options.gcsa_index + ".lcp")
-            if options.gbwt_index is not None:
-                indexes['gbwt'] = importer.load(options.gbwt_index)
-            if options.distance_index is not None:
-                indexes['distance'] = importer.load(options.distance_index)
-            if options.minimizer_index is not None:
-                indexes['minimizer'] = importer.load(options.minimizer_index)
-            if options.snarls_index is not None:
-                indexes['snarls'] = importer.load(options.snarls_index)
-            if options.id_ranges is not None:
-                indexes['id_ranges'] = importer.load(options.id_ranges)
+            # Upload each index we have. These are imported one by one rather
+            # than bundled: they may be remote URLs that we would have to
+            # download to tar up, the importer already overlaps the uploads,
+            # and run_pedigree needs a separate file ID for each index anyway.
+            index_paths = {
+                'xg': options.xg_index,
+                'gcsa': options.gcsa_index,
+                'lcp': options.gcsa_index + ".lcp" if options.gcsa_index is not None else None,
+                'gbwt': options.gbwt_index,
+                'distance': options.distance_index,
+                'minimizer': options.minimizer_index,
+                'snarls': options.snarls_index,
+                'id_ranges': options.id_ranges
+            }
+            # Only ship the indexes the chosen mapper will actually read, so
+            # every alignment job's arguments name just those.
+            used_index_types = mapper_index_types[options.mapper]
+            for index_type, index_path in index_paths.items():
+                if index_path is None:
+                    continue
+                if index_type not in used_index_types:
+                    logger.warning('Not importing {} index {}, which --mapper {} does not use'.format(
+                        index_type, index_path, options.mapper))
+                    continue
+                indexes[index_type] = importer.load(index_path)
             
             # Upload ref fasta files to the remote IO Store
             # ref_fasta_id, ref_fasta_index_id, ref_fasta_dict_id
@@ -1824,47 +1850,34 @@ def pedigree_main(context, options):
                 inputMiscFileIDs['genetic_map'] = importer.load(options.genetic_map)
             
             # Upload other local files to the remote IO Store
-            inputReadsFileIDsProband = []
-            if options.fastq_proband:
-                for sample_reads in options.fastq_proband:
-                    inputReadsFileIDsProband.append(importer.load(sample_reads))
-            elif options.gam_input_reads_proband:
-                inputReadsFileIDsProband.append(importer.load(options.gam_input_reads_proband))
-            else:
-                assert options.bam_input_reads_proband
-                inputReadsFileIDsProband.append(importer.load(options.bam_input_reads_proband))
-
-            inputReadsFileIDsMaternal = []
-            if options.fastq_maternal:
-                for sample_reads in options.fastq_maternal:
-                    inputReadsFileIDsMaternal.append(importer.load(sample_reads))
-            elif options.gam_input_reads_maternal:
-                inputReadsFileIDsMaternal.append(importer.load(options.gam_input_reads_maternal))
-            else:
-                assert options.bam_input_reads_maternal
-                inputReadsFileIDsMaternal.append(importer.load(options.bam_input_reads_maternal))
-            
-            inputReadsFileIDsPaternal = []
-            if options.fastq_paternal:
-                for sample_reads in options.fastq_paternal:
-                    inputReadsFileIDsPaternal.append(importer.load(sample_reads))
-            elif options.gam_input_reads_paternal:
-                inputReadsFileIDsPaternal.append(importer.load(options.gam_input_reads_paternal))
-            else:
-                assert options.bam_input_reads_paternal
-                inputReadsFileIDsPaternal.append(importer.load(options.bam_input_reads_paternal))
-            
-            inputReadsFileIDsSiblings = []
-            if options.fastq_siblings:
-                for sample_reads in options.fastq_siblings:
-                    inputReadsFileIDsSiblings.append(importer.load(sample_reads))
-            elif options.gam_input_reads_siblings:
-                for sample_gam_reads in options.gam_input_reads_siblings:
-                    inputReadsFileIDsSiblings.append(importer.load(sample_gam_reads))
-            elif options.bam_input_reads_siblings:
-                for sample_bam_reads in options.bam_input_reads_siblings:
-                    inputReadsFileIDsSiblings.append(importer.load(sample_bam_reads))
+            # Each member has reads as a list of fastqs, a gam or a bam; the
+            # siblings give a list for each kind and may have no reads at all.
+            def load_member_reads(fastq, gam_input_reads, bam_input_reads, required=True):
+                reads = fastq or gam_input_reads or bam_input_reads
+                assert reads or not required
+                if not reads:
+                    return []
+                if not isinstance(reads, list):
+                    reads = [reads]
+                return [importer.load(sample_reads) for sample_reads in reads]
+
+            inputReadsFileIDsProband, inputReadsFileIDsMaternal, inputReadsFileIDsPaternal = [
+                load_member_reads(getattr(options, 'fastq_' + member),
+                                  getattr(options, 'gam_input_reads_' + member),
+                                  getattr(options, 'bam_input_reads_' + member))
+                for member in ('proband', 'maternal', 'paternal')]
+            inputReadsFileIDsSiblings = load_member_reads(options.fastq_siblings, options.gam_input_reads_siblings,
+                                                          options.bam_input_reads_siblings, required=False)
             
+            # Init the outstore. This job doesn't need any imported files, so
+            # make it while the imports finish.
+            init_job = Job.wrapJobFn(run_write_info_to_outstore, context, sys.argv,
+                                     memory=context.config.misc_mem,
+                                     disk=context.config.misc_disk)
+
+            # The root job's arguments must be real file IDs, since the
+            # import Futures can't be pickled into the job store, so we have
+            # to wait before making it.
             importer.wait()
 
             # Make a root job
@@ -1895,11 +1908,7 @@ def pedigree_main(context, options):
                                      memory=context.config.misc_mem,
                                      disk=context.config.misc_disk)
 
-            # Init the outstore
-            init_job = Job.wrapJobFn(run_write_info_to_outstore, context, sys.argv,
-                                     memory=context.config.misc_mem,
-                                     disk=context.config.misc_disk)
-            init_job.addFollowOn(root_job)            
+            init_job.addFollowOn(root_job)
             
             # Run the job and store the returned list of output files to download
             toil.start(init_job)
@@ -1909,5 +1918,5 @@ def pedigree_main(context, options):
     end_time_pipeline = timeit.default_timer()
     run_time_pipeline = end_time_pipeline - start_time_pipeline
  
-    logger.info("All jobs completed successfully. Pipeline took {} seconds.".format(run_time_pipeline))
+    logger.info(f"All jobs completed successfully. Pipeline took {run_time_pipeline} seconds.")
     